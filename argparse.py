@@ -40,6 +40,13 @@ The module contains the following public classes:
         example above shows, instances of FileType are typically passed as
         the type= argument of add_argument() calls.
 
+    - LookupType -- A factory for types that select a value by name from an
+        enum.Enum subclass or a mapping. Enum subclasses and mappings passed
+        directly as the type= argument of add_argument() are wrapped in one.
+
+    - JSONType -- A factory for types that decode JSON documents given
+        either inline or as the name of a file to read them from.
+
     - Action -- The base class for parser actions. Typically actions are
         selected by passing strings like 'store_true' or 'append_const' to
         the action= argument of add_argument(). However, for greater
@@ -67,13 +74,20 @@ __all__ = [
     'ArgumentError',
     'ArgumentTypeError',
     'FileType',
+    'LookupType',
+    'JSONType',
     'HelpFormatter',
     'ArgumentDefaultsHelpFormatter',
     'RawDescriptionHelpFormatter',
     'RawTextHelpFormatter',
     'MetavarTypeHelpFormatter',
     'Namespace',
+    'Provenance',
+    'InternTable',
     'Action',
+    'FROM_COMMAND_LINE',
+    'FROM_DEFAULT',
+    'FROM_NAMESPACE',
     'ONE_OR_MORE',
     'OPTIONAL',
     'PARSER',
@@ -84,7 +98,11 @@ __all__ = [
 
 
 import collections as _collections
+import collections.abc as _collections_abc
+import contextvars as _contextvars
 import copy as _copy
+import functools as _functools
+import itertools as _itertools
 import os as _os
 import re as _re
 import sys as _sys
@@ -100,7 +118,17 @@ ZERO_OR_MORE = '*'
 ONE_OR_MORE = '+'
 PARSER = 'A...'
 REMAINDER = '...'
+
+FROM_DEFAULT = 0
+FROM_NAMESPACE = 1
+FROM_COMMAND_LINE = 2
 _UNRECOGNIZED_ARGS_ATTR = '_unrecognized_args'
+_DEFAULT_CONVERSION_CACHE_SIZE = 1024
+_CHOICES_HEAD = 10
+_CHOICES_TAIL = 3
+_SHARED_ARRAY_MIN_LENGTH = 256
+_REPR_LIMIT = 100
+_WRAP_CACHE_SIZE = 1024
 
 # =============================
 # Utility functions and classes
@@ -113,16 +141,31 @@ class _AttributeHolder(object):
         ClassName(attr=name, attr=name, ...)
     The attributes are determined either by a class-level attribute,
     '_kwarg_names', or by inspecting the instance __dict__.
+
+    Lists, tuples, sets and dicts in the attributes show at most
+    _REPR_LIMIT items each, followed by a count of the others.
     """
 
     def __repr__(self):
-        type_name = type(self).__name__
-        arg_strings = []
+        pieces = []
+        _write_value_repr(pieces.append, self, _REPR_LIMIT, set())
+        return ''.join(pieces)
+
+    def _write_repr(self, write, limit, active):
+        write(type(self).__name__)
+        write('(')
+        separator = ''
         for arg in self._get_args():
-            arg_strings.append(repr(arg))
+            write(separator)
+            _write_value_repr(write, arg, limit, active)
+            separator = ', '
         for name, value in self._get_kwargs():
-            arg_strings.append('%s=%r' % (name, value))
-        return '%s(%s)' % (type_name, ', '.join(arg_strings))
+            write(separator)
+            write(name)
+            write('=')
+            _write_value_repr(write, value, limit, active)
+            separator = ', '
+        write(')')
 
     def _get_kwargs(self):
         return sorted(self.__dict__.items())
@@ -131,12 +174,235 @@ class _AttributeHolder(object):
         return []
 
 
+# the brackets of the containers whose items _write_value_repr() writes
+# itself, and what to write when they are empty
+_REPR_BRACKETS = {
+    list: ('[', ']', '[]'),
+    tuple: ('(', ')', '()'),
+    set: ('{', '}', 'set()'),
+    frozenset: ('frozenset({', '})', 'frozenset()'),
+    dict: ('{', '}', '{}'),
+}
+
+
+def _write_value_repr(write, value, limit, active):
+    # containers are written item by item, with at most limit items each
+    # unless it is None
+    if isinstance(value, _AttributeHolder):
+        if id(value) in active:
+            write('...')
+            return
+        active.add(id(value))
+        try:
+            value._write_repr(write, limit, active)
+        finally:
+            active.discard(id(value))
+        return
+    brackets = _REPR_BRACKETS.get(type(value))
+    if brackets is None:
+        write(repr(value))
+        return
+    start, end, empty = brackets
+    if not value:
+        write(empty)
+        return
+    if id(value) in active:
+        write(start + '...' + end)
+        return
+
+    active.add(id(value))
+    try:
+        write(start)
+        is_dict = type(value) is dict
+        items = iter(value.items() if is_dict else value)
+        for i, item in enumerate(_itertools.islice(items, limit)):
+            if i:
+                write(', ')
+            if is_dict:
+                _write_value_repr(write, item[0], limit, active)
+                write(': ')
+                item = item[1]
+            _write_value_repr(write, item, limit, active)
+        if limit is not None and len(value) > limit:
+            if limit:
+                write(', ')
+            write('... (%d more)' % (len(value) - limit))
+        elif len(value) == 1 and type(value) is tuple:
+            write(',')
+        write(end)
+    finally:
+        active.discard(id(value))
+
+
 def _ensure_value(namespace, name, value):
     if getattr(namespace, name, None) is None:
         setattr(namespace, name, value)
     return getattr(namespace, name)
 
 
+def _format_choices(choices, format=str, sep=', ', count=True):
+    # render at most the first _CHOICES_HEAD and last _CHOICES_TAIL
+    # choices, so that huge containers are never iterated in full
+    head = tail = ()
+    omitted = 0
+    if isinstance(choices, _collections_abc.Sequence):
+        size = len(choices)
+        if size <= _CHOICES_HEAD + _CHOICES_TAIL:
+            head = choices
+        elif isinstance(choices, range) and choices.step == 1:
+            return '%s..%s' % (format(choices[0]), format(choices[-1]))
+        else:
+            head = [choices[i] for i in range(_CHOICES_HEAD)]
+            tail = [choices[i] for i in range(size - _CHOICES_TAIL, size)]
+            omitted = size - _CHOICES_HEAD - _CHOICES_TAIL
+    else:
+        limit = _CHOICES_HEAD + _CHOICES_TAIL
+        head = list(_itertools.islice(choices, limit + 1))
+        if len(head) > limit:
+            head = head[:_CHOICES_HEAD]
+            if isinstance(choices, _collections_abc.Sized):
+                omitted = len(choices) - _CHOICES_HEAD
+            else:
+                omitted = None
+
+    # the omitted choices are replaced by an ellipsis and their number
+    parts = [format(choice) for choice in head]
+    if omitted != 0:
+        if count and omitted is not None:
+            parts.append(_('... (%d more)') % omitted)
+        else:
+            parts.append('...')
+    parts.extend([format(choice) for choice in tail])
+    return sep.join(parts)
+
+
+class _DeferredValue(object):
+    """Placeholder for a value whose conversion is still pending.
+
+    Placeholders are stored in the namespace like any other value and are
+    replaced by the converted values once the arguments have been parsed.
+    String results are interned in the InternTable of the parse that
+    deferred them.
+    """
+
+    def __init__(self, action, arg_string, pending):
+        self.action = action
+        self.arg_string = arg_string
+        self.pending = pending
+        self.check = False
+        self.result = None
+        self.intern_table = _intern_table.get()
+
+
+class _DeferredConversions(object):
+    """The conversions deferred while parsing one command line.
+
+    Pending conversions are either awaitables returned by coroutine type
+    functions or, if executor is not None, futures of the executor.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self.values = []
+
+    def add(self, action, arg_string, pending):
+        value = _DeferredValue(action, arg_string, pending)
+        self.values.append(value)
+        return value
+
+    def results(self):
+        # wait for the futures in argument order
+        for value in self.values:
+            try:
+                yield None, value.pending.result()
+            except Exception:
+                yield _sys.exc_info()[1], None
+
+    def cancel(self):
+        # close coroutines that will never be awaited, cancel futures
+        for value in self.values:
+            close = getattr(value.pending, 'close', None)
+            if close is None:
+                value.pending.cancel()
+            else:
+                close()
+
+
+# the conversions deferred by the parse in progress in this context, which
+# includes the parses of any subparsers it invokes
+_deferred_conversions = _contextvars.ContextVar('argparse_deferred_conversions',
+                                                default=None)
+
+# the lists created by append actions during the parse in progress in this
+# context, by id, which are appended to in place rather than copied again
+_owned_lists = _contextvars.ContextVar('argparse_owned_lists', default=None)
+
+# the Provenance that the parse in progress in this context, and the parses
+# of any subparsers it invokes, record the sources of their values in
+_provenance = _contextvars.ContextVar('argparse_provenance', default=None)
+
+# the InternTable of the parse in progress in this context, which its
+# subparsers share unless they have their own
+_intern_table = _contextvars.ContextVar('argparse_intern_table', default=None)
+
+# whether a parser invoking the subparsers in this context raises errors
+# instead of exiting, so that the subparsers raise them as well
+_raise_errors = _contextvars.ContextVar('argparse_raise_errors', default=False)
+
+
+def _owned_items(namespace, name):
+    # the first append of a parse copies the current list, so that defaults
+    # are never modified, and later ones extend that copy
+    items = getattr(namespace, name, None)
+    owned = _owned_lists.get()
+    if items is None:
+        items = []
+    elif owned is not None and owned.get(id(items)) is items:
+        return items
+    else:
+        items = _copy.copy(items)
+    if owned is not None:
+        owned[id(items)] = items
+    setattr(namespace, name, items)
+    return items
+
+
+def _resolve_deferred_values(value):
+    if isinstance(value, _DeferredValue):
+        return value.result
+    if isinstance(value, list):
+        for i, item in enumerate(value):
+            resolved = _resolve_deferred_values(item)
+            if resolved is not item:
+                value[i] = resolved
+    return value
+
+
+@_functools.lru_cache(maxsize=_WRAP_CACHE_SIZE)
+def _wrap_text(text, width):
+    # text with normalized whitespace is filled greedily, which gives the
+    # lines textwrap.wrap() gives unless it would break a word, either at a
+    # hyphen or because the word is wider than the lines
+    words = text.split(' ') if text else []
+    if (not text.isascii() or '-' in text or width < 1 or
+            any([len(word) > width for word in words])):
+        return tuple(_textwrap.wrap(text, width))
+
+    lines = []
+    line = []
+    length = -1
+    for word in words:
+        if line and length + 1 + len(word) > width:
+            lines.append(' '.join(line))
+            line = []
+            length = -1
+        line.append(word)
+        length += 1 + len(word)
+    if line:
+        lines.append(' '.join(line))
+    return tuple(lines)
+
+
 # ===============
 # Formatting Help
 # ===============
@@ -202,8 +468,6 @@ class HelpFormatter(object):
             if self.parent is not None:
                 self.formatter._indent()
             join = self.formatter._join_parts
-            for func, args in self.items:
-                func(*args)
             item_help = join([func(*args) for func, args in self.items])
             if self.parent is not None:
                 self.formatter._dedent()
@@ -319,13 +583,9 @@ class HelpFormatter(object):
             if len(prefix) + len(usage) > text_width:
 
                 # break usage into wrappable parts
-                part_regexp = r'\(.*?\)+|\[.*?\]+|\S+'
-                opt_usage = format(optionals, groups)
-                pos_usage = format(positionals, groups)
-                opt_parts = _re.findall(part_regexp, opt_usage)
-                pos_parts = _re.findall(part_regexp, pos_usage)
-                assert ' '.join(opt_parts) == opt_usage
-                assert ' '.join(pos_parts) == pos_usage
+                get_parts = self._get_actions_usage_parts
+                opt_parts = get_parts(optionals, groups)
+                pos_parts = get_parts(positionals, groups)
 
                 # helper for wrapping lines
                 def get_lines(parts, indent, prefix=None):
@@ -336,7 +596,7 @@ class HelpFormatter(object):
                     else:
                         line_len = len(indent) - 1
                     for part in parts:
-                        if line_len + 1 + len(part) > text_width:
+                        if line_len + 1 + len(part) > text_width and line:
                             lines.append(indent + ' '.join(line))
                             line = []
                             line_len = len(indent) - 1
@@ -377,101 +637,87 @@ class HelpFormatter(object):
         return '%s%s\n\n' % (prefix, usage)
 
     def _format_actions_usage(self, actions, groups):
-        # find group indices and identify actions in groups
-        group_actions = set()
-        inserts = {}
+        return ' '.join(self._get_actions_usage_parts(actions, groups))
+
+    def _get_actions_usage_parts(self, actions, groups):
+        # map the actions of each group whose actions are all present, in
+        # order and next to each other, to that group
+        positions = dict([(action, i) for i, action in enumerate(actions)])
+        action_groups = {}
         for group in groups:
-            try:
-                start = actions.index(group._group_actions[0])
-            except ValueError:
+            group_actions = group._group_actions
+            if not group_actions:
                 continue
-            else:
-                end = start + len(group._group_actions)
-                if actions[start:end] == group._group_actions:
-                    for action in group._group_actions:
-                        group_actions.add(action)
-                    if not group.required:
-                        if start in inserts:
-                            inserts[start] += ' ['
-                        else:
-                            inserts[start] = '['
-                        inserts[end] = ']'
-                    else:
-                        if start in inserts:
-                            inserts[start] += ' ('
-                        else:
-                            inserts[start] = '('
-                        inserts[end] = ')'
-                    for i in range(start + 1, end):
-                        inserts[i] = '|'
+            start = positions.get(group_actions[0])
+            if start is None:
+                continue
+            end = start + len(group_actions)
+            if actions[start:end] == group_actions:
+                for action in group_actions:
+                    action_groups[action] = group
 
-        # collect all actions format strings
+        # format each action outside a group as one part, and the actions
+        # of each group together as one part
         parts = []
-        for i, action in enumerate(actions):
-
-            # suppressed arguments are marked with None
-            # remove | separators for suppressed arguments
-            if action.help is SUPPRESS:
-                parts.append(None)
-                if inserts.get(i) == '|':
-                    inserts.pop(i)
-                elif inserts.get(i + 1) == '|':
-                    inserts.pop(i + 1)
-
-            # produce all arg strings
-            elif not action.option_strings:
-                default = self._get_default_metavar_for_positional(action)
-                part = self._format_args(action, default)
-
-                # if it's in a group, strip the outer []
-                if action in group_actions:
-                    if part[0] == '[' and part[-1] == ']':
-                        part = part[1:-1]
-
-                # add the action string to the list
-                parts.append(part)
-
-            # produce the first way to invoke the option in brackets
-            else:
-                option_string = action.option_strings[0]
+        i = 0
+        while i < len(actions):
+            group = action_groups.get(actions[i])
+            if group is None:
+                part = self._format_action_usage(actions[i], False)
+                if part:
+                    parts.append(part)
+                i += 1
+                continue
 
-                # if the Optional doesn't take a value, format is:
-                #    -s or --long
-                if action.nargs == 0:
-                    part = '%s' % option_string
+            # suppressed arguments are left out of their group, and a
+            # group without any other arguments is left out entirely
+            members = [self._format_action_usage(action, True)
+                       for action in group._group_actions]
+            members = [member for member in members if member]
+            if members:
+                part = ' | '.join(members)
+                if not group.required:
+                    part = '[%s]' % part
+                elif len(members) > 1:
+                    part = '(%s)' % part
+                parts.append(part)
+            i += len(group._group_actions)
+        return parts
 
-                # if the Optional takes a value, format is:
-                #    -s ARGS or --long ARGS
-                else:
-                    default = self._get_default_metavar_for_optional(action)
-                    args_string = self._format_args(action, default)
-                    part = '%s %s' % (option_string, args_string)
+    def _format_action_usage(self, action, in_group):
+        # suppressed arguments are not shown
+        if action.help is SUPPRESS:
+            return None
 
-                # make it look optional if it's not required or in a group
-                if not action.required and action not in group_actions:
-                    part = '[%s]' % part
+        # produce all arg strings
+        if not action.option_strings:
+            default = self._get_default_metavar_for_positional(action)
+            part = self._format_args(action, default)
 
-                # add the action string to the list
-                parts.append(part)
+            # if it's in a group, strip the outer []
+            if in_group and part.startswith('[') and part.endswith(']'):
+                part = part[1:-1]
+            return part
 
-        # insert things at the necessary indices
-        for i in sorted(inserts, reverse=True):
-            parts[i:i] = [inserts[i]]
+        # produce the first way to invoke the option in brackets
+        option_string = action.option_strings[0]
 
-        # join all the action items with spaces
-        text = ' '.join([item for item in parts if item is not None])
+        # if the Optional doesn't take a value, format is:
+        #    -s or --long
+        if action.nargs == 0:
+            part = '%s' % option_string
 
-        # clean up separators for mutually exclusive groups
-        open = r'[\[(]'
-        close = r'[\])]'
-        text = _re.sub(r'(%s) ' % open, r'\1', text)
-        text = _re.sub(r' (%s)' % close, r'\1', text)
-        text = _re.sub(r'%s *%s' % (open, close), r'', text)
-        text = _re.sub(r'\(([^|]*)\)', r'\1', text)
-        text = text.strip()
+        # if the Optional takes a value, format is:
+        #    -s ARGS or --long ARGS
+        else:
+            default = self._get_default_metavar_for_optional(action)
+            args_string = self._format_args(action, default)
+            part = '%s %s' % (option_string, args_string)
 
-        # return the text
-        return text
+        # make it look optional if it's not required or in a group
+        if not action.required and not in_group:
+            part = '[%s]' % part
+        return part
 
     def _format_text(self, text):
         if '%(prog)' in text:
@@ -528,6 +774,19 @@ class HelpFormatter(object):
         return self._join_parts(parts)
 
     def _format_action_invocation(self, action):
+        # invocations are measured and then rendered, so they are kept on
+        # the action for each formatter class until the action changes
+        strings = action.__dict__.get('_help_strings')
+        if strings is None:
+            strings = action._help_strings = {}
+        key = 'invocation', type(self)
+        invocation = strings.get(key)
+        if invocation is None:
+            invocation = self._get_action_invocation(action)
+            strings[key] = invocation
+        return invocation
+
+    def _get_action_invocation(self, action):
         if not action.option_strings:
             default = self._get_default_metavar_for_positional(action)
             metavar, = self._metavar_formatter(action, default)(1)
@@ -555,8 +814,8 @@ class HelpFormatter(object):
         if action.metavar is not None:
             result = action.metavar
         elif action.choices is not None:
-            choice_strs = [str(choice) for choice in action.choices]
-            result = '{%s}' % ','.join(choice_strs)
+            choices_str = _format_choices(action.choices, sep=',', count=False)
+            result = '{%s}' % choices_str
         else:
             result = default_metavar
 
@@ -568,6 +827,19 @@ class HelpFormatter(object):
         return format
 
     def _format_args(self, action, default_metavar):
+        # args strings are shared by the usage and the invocations, so they
+        # are kept on the action like the invocations
+        strings = action.__dict__.get('_help_strings')
+        if strings is None:
+            strings = action._help_strings = {}
+        key = 'args', type(self), default_metavar
+        args_string = strings.get(key)
+        if args_string is None:
+            args_string = self._get_args_string(action, default_metavar)
+            strings[key] = args_string
+        return args_string
+
+    def _get_args_string(self, action, default_metavar):
         get_metavar = self._metavar_formatter(action, default_metavar)
         if action.nargs is None:
             result = '%s' % get_metavar(1)
@@ -595,8 +867,7 @@ class HelpFormatter(object):
             if hasattr(params[name], '__name__'):
                 params[name] = params[name].__name__
         if params.get('choices') is not None:
-            choices_str = ', '.join([str(c) for c in params['choices']])
-            params['choices'] = choices_str
+            params['choices'] = _format_choices(params['choices'])
         return self._get_help_string(action) % params
 
     def _iter_indented_subactions(self, action):
@@ -611,12 +882,15 @@ class HelpFormatter(object):
 
     def _split_lines(self, text, width):
         text = self._whitespace_matcher.sub(' ', text).strip()
-        return _textwrap.wrap(text, width)
+        return list(_wrap_text(text, width))
 
     def _fill_text(self, text, width, indent):
         text = self._whitespace_matcher.sub(' ', text).strip()
-        return _textwrap.fill(text, width, initial_indent=indent,
-                                           subsequent_indent=indent)
+        if width - len(indent) < 1:
+            return _textwrap.fill(text, width, initial_indent=indent,
+                                               subsequent_indent=indent)
+        lines = _wrap_text(text, width - len(indent))
+        return '\n'.join([indent + line for line in lines])
 
     def _get_help_string(self, action):
         return action.help
@@ -729,6 +1003,24 @@ class ArgumentTypeError(Exception):
 # Action classes
 # ==============
 
+# the attributes of actions that parse templates, cached help and generated
+# namespace classes are derived from
+_DERIVED_ACTION_ATTRIBUTES = frozenset([
+    'option_strings',
+    'dest',
+    'nargs',
+    'const',
+    'default',
+    'default_factory',
+    'type',
+    'conversion_cache',
+    'choices',
+    'required',
+    'help',
+    'metavar',
+])
+
+
 class Action(_AttributeHolder):
     """Information about how to convert command line strings to Python objects.
 
@@ -763,7 +1055,10 @@ class Action(_AttributeHolder):
         - type -- A callable that accepts a single string argument, and
             returns the converted value.  The standard Python types str, int,
             float, and complex are useful examples of such callables.  If None,
-            str is used.
+            str is used.  If the callable has a try_convert() method, that is
+            called instead and returns an (ok, value) pair, where value is
+            the converted value or, if ok is false, an error message (or
+            None for the generic message).
 
         - choices -- A container of values that should be allowed. If not None,
             after a command-line argument has been converted to the appropriate
@@ -778,8 +1073,24 @@ class Action(_AttributeHolder):
 
         - metavar -- The name to be used for the option's argument with the
             help string. If None, the 'dest' value will be used as the name.
+
+    Actions created through add_argument() with cache=True also carry a
+    conversion_cache attribute: the memoised type function, whose
+    cache_info() method reports the hits and misses of the cache.
+    Those created with default_factory= carry it as their default_factory
+    attribute, which is called after parsing if the dest was not set.
+
+    Subclasses may define an apply_batch(parser, namespace, occurrences)
+    method, which is then called once after the command line has been
+    parsed instead of calling the action for each occurrence; occurrences
+    is the list of (values, option_string) pairs in command-line order.
     """
 
+    conversion_cache = None
+    default_factory = None
+    apply_batch = None
+    _choices_index = None
+
     def __init__(self,
                  option_strings,
                  dest,
@@ -816,6 +1127,21 @@ class Action(_AttributeHolder):
         ]
         return [(name, getattr(self, name)) for name in names]
 
+    def __setattr__(self, name, value):
+        # changing an action invalidates what its parsers derived from it,
+        # while other attributes, such as state kept by custom actions, do
+        # not
+        if name in _DERIVED_ACTION_ATTRIBUTES:
+            self._invalidate()
+        object.__setattr__(self, name, value)
+
+    def _invalidate(self):
+        # the action may be shared by several parsers through parents=,
+        # so the revision of each parser that added it is bumped
+        self.__dict__.pop('_help_strings', None)
+        for revision in self.__dict__.get('_revisions', ()):
+            revision[0] += 1
+
     def __call__(self, parser, namespace, values, option_string=None):
         raise NotImplementedError(_('.__call__() not defined'))
 
@@ -944,9 +1270,15 @@ class _AppendAction(Action):
             metavar=metavar)
 
     def __call__(self, parser, namespace, values, option_string=None):
-        items = _copy.copy(_ensure_value(namespace, self.dest, []))
+        items = _owned_items(namespace, self.dest)
         items.append(values)
-        setattr(namespace, self.dest, items)
+
+
+class _ExtendAction(_AppendAction):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        items = _owned_items(namespace, self.dest)
+        items.extend(values)
 
 
 class _AppendConstAction(Action):
@@ -970,9 +1302,8 @@ class _AppendConstAction(Action):
             metavar=metavar)
 
     def __call__(self, parser, namespace, values, option_string=None):
-        items = _copy.copy(_ensure_value(namespace, self.dest, []))
+        items = _owned_items(namespace, self.dest)
         items.append(self.const)
-        setattr(namespace, self.dest, items)
 
 
 class _CountAction(Action):
@@ -1094,12 +1425,16 @@ class _SubParsersAction(Action):
         for alias in aliases:
             self._name_parser_map[alias] = parser
 
+        # the help of the parsers holding this action lists the new choice
+        self._invalidate()
+
         return parser
 
     def _get_subactions(self):
         return self._choices_actions
 
     def __call__(self, parser, namespace, values, option_string=None):
+        parent_parser = parser
         parser_name = values[0]
         arg_strings = values[1:]
 
@@ -1112,16 +1447,26 @@ class _SubParsersAction(Action):
             parser = self._name_parser_map[parser_name]
         except KeyError:
             args = {'parser_name': parser_name,
-                    'choices': ', '.join(self._name_parser_map)}
+                    'choices': _format_choices(self._name_parser_map)}
             msg = _('unknown parser %(parser_name)r (choices: %(choices)s)') % args
             raise ArgumentError(self, msg)
 
         # parse all the remaining options into the namespace
         # store any unrecognized options on the object, so that the top
         # level parser can decide what to do with them
-        namespace, arg_strings = parser.parse_known_args(arg_strings, namespace)
+        if getattr(parent_parser, 'exit_on_error', True):
+            namespace, arg_strings = parser.parse_known_args(arg_strings,
+                                                             namespace)
+        else:
+            token = _raise_errors.set(True)
+            try:
+                namespace, arg_strings = parser.parse_known_args(arg_strings,
+                                                                 namespace)
+            finally:
+                _raise_errors.reset(token)
         if arg_strings:
-            vars(namespace).setdefault(_UNRECOGNIZED_ARGS_ATTR, [])
+            if not hasattr(namespace, _UNRECOGNIZED_ARGS_ATTR):
+                setattr(namespace, _UNRECOGNIZED_ARGS_ATTR, [])
             getattr(namespace, _UNRECOGNIZED_ARGS_ATTR).extend(arg_strings)
 
 
@@ -1179,6 +1524,159 @@ class FileType(object):
                               if arg is not None])
         return '%s(%s)' % (type(self).__name__, args_str)
 
+
+class LookupType(object):
+    """Factory for creating types that look values up by name
+
+    Instances of LookupType are typically passed as type= arguments to the
+    ArgumentParser add_argument() method. Passing an enum.Enum subclass or
+    a mapping directly as type= creates a LookupType for it.
+
+    The name table is built once, so converting and validating a value is a
+    single dictionary lookup.
+
+    Keyword Arguments:
+        - source -- Either an enum.Enum subclass, whose members are looked
+            up by name (or by value, for members with string values), or a
+            mapping from strings to the values they select.
+        - ignore_case -- If true, names are matched case-insensitively.
+    """
+
+    def __init__(self, source, ignore_case=False):
+        self._source = source
+        self._ignore_case = ignore_case
+
+        # enum members are found by name and, failing that, by string value
+        names = getattr(source, '__members__', source)
+        table = {}
+        if names is not source:
+            for member in source:
+                if isinstance(member.value, str):
+                    table[member.value] = member
+        table.update(names)
+        self._names = list(names)
+
+        # precompute the casefolded table for case-insensitive lookups
+        if ignore_case:
+            table = dict((name.casefold(), value)
+                         for name, value in table.items())
+        self._table = table
+
+    def __call__(self, string):
+        ok, result = self.try_convert(string)
+        if not ok:
+            raise ArgumentTypeError(result)
+        return result
+
+    def try_convert(self, string):
+        key = string.casefold() if self._ignore_case else string
+        if key in self._table:
+            return True, self._table[key]
+        args = {'value': string,
+                'choices': _format_choices(self._names, repr)}
+        msg = _('invalid choice: %(value)r (choose from %(choices)s)')
+        return False, msg % args
+
+    def __repr__(self):
+        args_str = repr(self._source)
+        if self._ignore_case:
+            args_str += ', ignore_case=True'
+        return '%s(%s)' % (type(self).__name__, args_str)
+
+
+class JSONType(object):
+    """Factory for creating types that decode JSON documents
+
+    Instances of JSONType are typically passed as type= arguments to the
+    ArgumentParser add_argument() method. The command-line string is either
+    the JSON text itself or, when it starts with one of the prefix
+    characters, the name of a file holding the document.
+
+    Files are opened directly and read once as bytes, never more than
+    max_size bytes, and are not split into argument lines the way
+    fromfile_prefix_chars files are.
+
+    Keyword Arguments:
+        - max_size -- The maximum size of a document, in bytes for files and
+            in characters for inline text. None means that there is no limit.
+        - prefix_chars -- Characters that mark the string as a file name.
+    """
+
+    def __init__(self, max_size=None, prefix_chars='@'):
+        self._max_size = max_size
+        self._prefix_chars = prefix_chars
+
+    def __call__(self, string):
+        import json as _json
+
+        # prefixed strings name the file holding the document
+        if string and string[0] in self._prefix_chars:
+            name = string[1:]
+            try:
+                with open(name, 'rb') as file:
+                    if self._max_size is None:
+                        text = file.read()
+                    else:
+                        text = file.read(self._max_size + 1)
+            except OSError as e:
+                message = _("can't open '%s': %s")
+                raise ArgumentTypeError(message % (name, e))
+        else:
+            name = None
+            text = string
+
+        # refuse documents over the size limit, which is in bytes for
+        # files and in characters for inline text
+        if self._max_size is not None and len(text) > self._max_size:
+            if name is None:
+                args = {'max_size': self._max_size}
+                msg = _('JSON document is longer than %(max_size)d '
+                        'characters')
+            else:
+                args = {'document': name, 'max_size': self._max_size}
+                msg = _('%(document)s is larger than %(max_size)d bytes')
+            raise ArgumentTypeError(msg % args)
+
+        # decode the document
+        try:
+            return _json.loads(text)
+        except ValueError as e:
+            if name is None:
+                message = _('invalid JSON: %s') % e
+            else:
+                message = _("invalid JSON in '%s': %s") % (name, e)
+            raise ArgumentTypeError(message)
+
+    def __repr__(self):
+        kwargs = [('max_size', self._max_size, None),
+                  ('prefix_chars', self._prefix_chars, '@')]
+        args_str = ', '.join(['%s=%r' % (kw, arg)
+                              for kw, arg, default in kwargs
+                              if arg != default])
+        return '%s(%s)' % (type(self).__name__, args_str)
+
+
+def _index_choices(choices):
+    # tuples of hashable choices are indexed by a frozenset; the original
+    # tuple is kept, both for display and to detect replacement. Lists and
+    # other containers may change or define their own __contains__, so they
+    # are not indexed
+    if type(choices) is not tuple:
+        return choices, None
+    try:
+        members = frozenset(choices)
+    except TypeError:
+        members = None
+    return choices, members
+
+
+def _is_lookup_source(type_func):
+    # enum.Enum subclasses and mappings are converted by name lookup
+    if isinstance(type_func, type):
+        return isinstance(getattr(type_func, '__members__', None),
+                          _collections_abc.Mapping)
+    return isinstance(type_func, _collections_abc.Mapping)
+
 # ===========================
 # Optional and Positional Parsing
 # ===========================
@@ -1204,6 +1702,437 @@ class Namespace(_AttributeHolder):
         return key in self.__dict__
 
 
+class _RecordBuffer(Namespace):
+    """The flat buffer collecting the values of a target= record.
+
+    Actions store values in it like in any namespace, but its attributes
+    are the dict of values that the record is built from.
+    """
+
+    def __init__(self, values):
+        self.__dict__ = values
+
+
+class Provenance(_AttributeHolder):
+    """Record of where the value of each destination came from.
+
+    An instance passed as the provenance= argument of parse_args() maps
+    each destination set by the parse, including those of any subparsers
+    invoked, to FROM_COMMAND_LINE, FROM_NAMESPACE if the namespace passed
+    in already held a value, or FROM_DEFAULT.
+    """
+
+    def __init__(self):
+        self._sources = {}
+
+    def __getitem__(self, dest):
+        return self._sources[dest]
+
+    def __contains__(self, dest):
+        return dest in self._sources
+
+    def __iter__(self):
+        return iter(self._sources)
+
+    def __len__(self):
+        return len(self._sources)
+
+    def get(self, dest, default=None):
+        return self._sources.get(dest, default)
+
+    def from_command_line(self):
+        """Return the destinations that were set from the command line."""
+        return [dest
+                for dest, source in self._sources.items()
+                if source == FROM_COMMAND_LINE]
+
+    def _get_kwargs(self):
+        return sorted(self._sources.items())
+
+    def _record(self, dest, source):
+        # a destination keeps the source that takes precedence
+        if source > self._sources.get(dest, -1):
+            self._sources[dest] = source
+
+
+class InternTable(_AttributeHolder):
+    """Table of the strings shared by the results of many parses.
+
+    A parser created with an InternTable as its intern_table= argument
+    replaces each string value and unrecognized argument by an equal
+    string already in the table, so that the namespaces of many parses
+    share one copy of each. At most maxsize strings are kept; later ones
+    are returned unchanged. The hits, misses and bytes_saved attributes
+    count the lookups and the sizes of the strings that were replaced.
+    """
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def intern(self, string):
+        """Return the string in the table equal to string, adding it if
+        there is room."""
+        strings = self._strings
+        interned = strings.get(string)
+        if interned is None:
+            self.misses += 1
+            if len(strings) < self.maxsize:
+                strings[string] = string
+            return string
+        self.hits += 1
+        if interned is not string:
+            self.bytes_saved += _sys.getsizeof(string)
+        return interned
+
+    def clear(self):
+        """Remove all the strings and reset the counts."""
+        self._strings.clear()
+        self.hits = self.misses = self.bytes_saved = 0
+
+    def _get_kwargs(self):
+        names = ['maxsize', 'hits', 'misses', 'bytes_saved']
+        return [('size', len(self))] + [(name, getattr(self, name))
+                                        for name in names]
+
+
+# the descriptor of the real instance dictionary, which _SlotsNamespace
+# hides behind its __dict__ property
+_instance_dict = _AttributeHolder.__dict__['__dict__'].__get__
+
+
+class _FlagDescriptor(object):
+    """An attribute of a generated namespace stored as a bit of _flag_bits.
+
+    Values are stored as their truth value. The same bit of _flag_set
+    records whether the flag is set at all, so that flags can be deleted.
+    """
+
+    def __init__(self, name, bit):
+        self.name = name
+        self.bit = bit
+
+    def __get__(self, namespace, owner=None):
+        if namespace is None:
+            return self
+        if not getattr(namespace, '_flag_set', 0) & self.bit:
+            raise AttributeError(self.name)
+        return namespace._flag_bits & self.bit != 0
+
+    def __set__(self, namespace, value):
+        bits = getattr(namespace, '_flag_bits', 0)
+        namespace._flag_set = getattr(namespace, '_flag_set', 0) | self.bit
+        if value:
+            namespace._flag_bits = bits | self.bit
+        else:
+            namespace._flag_bits = bits & ~self.bit
+
+    def __delete__(self, namespace):
+        flag_set = getattr(namespace, '_flag_set', 0)
+        if not flag_set & self.bit:
+            raise AttributeError(self.name)
+        namespace._flag_set = flag_set & ~self.bit
+        namespace._flag_bits &= ~self.bit
+
+
+class _SlotsNamespace(Namespace):
+    """Base class of the namespaces generated by parsers.
+
+    Classes are generated for namespace_class='slots' and for flag
+    groups. Attributes named in
+    __slots__ are stored without an instance dictionary, those named in
+    _flag_names as the bits of _flag_bits and _flag_set, and any others in
+    the usual
+    way. The __dict__ property returns a mapping of all of them that
+    writes through to the namespace, so vars() and the Namespace methods
+    work as for other namespaces.
+    """
+
+    __slots__ = ('_flag_bits', '_flag_set')
+    _flag_names = ()
+
+    @property
+    def __dict__(self):
+        return _NamespaceDict(self)
+
+    def _get_attributes(self):
+        result = {}
+        for name in self.__slots__:
+            try:
+                result[name] = getattr(self, name)
+            except AttributeError:
+                pass
+        flag_set = getattr(self, '_flag_set', 0)
+        if flag_set:
+            bits = self._flag_bits
+            for i, name in enumerate(self._flag_names):
+                if flag_set >> i & 1:
+                    result[name] = bool(bits >> i & 1)
+        result.update(_instance_dict(self))
+        return result
+
+    def __copy__(self):
+        return type(self)(**self._get_attributes())
+
+    def __deepcopy__(self, memo):
+        return type(self)(**_copy.deepcopy(self._get_attributes(), memo))
+
+    def __reduce__(self):
+        # the generated classes cannot be pickled, so plain namespaces are
+        return Namespace, (), self._get_attributes()
+
+
+class _NamespaceDict(_collections_abc.MutableMapping):
+    """The attributes of a generated namespace, as returned by vars().
+
+    Reading, setting and deleting items reads, sets and deletes the
+    attributes of the namespace.
+    """
+
+    def __init__(self, namespace):
+        self._namespace = namespace
+
+    def __getitem__(self, name):
+        namespace = self._namespace
+        values = _instance_dict(namespace)
+        if name in values:
+            return values[name]
+        if name in type(namespace).__slots__ or name in namespace._flag_names:
+            try:
+                return getattr(namespace, name)
+            except AttributeError:
+                pass
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        setattr(self._namespace, name, value)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        try:
+            delattr(self._namespace, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __iter__(self):
+        return iter(self._namespace._get_attributes())
+
+    def __len__(self):
+        return len(self._namespace._get_attributes())
+
+    def __repr__(self):
+        return repr(self._namespace._get_attributes())
+
+    def copy(self):
+        return self._namespace._get_attributes()
+
+
+def _get_record_fields(target):
+    # the (name, required) pairs of the fields of a dataclass or named tuple
+    if isinstance(target, type) and hasattr(target, '__dataclass_fields__'):
+        import dataclasses as _dataclasses
+        missing = _dataclasses.MISSING
+        return [(field.name, (field.default is missing and
+                              field.default_factory is missing))
+                for field in _dataclasses.fields(target)
+                if field.init]
+    if isinstance(target, type) and issubclass(target, tuple):
+        if hasattr(target, '_fields'):
+            defaults = getattr(target, '_field_defaults', {})
+            return [(name, name not in defaults) for name in target._fields]
+    msg = 'target must be a dataclass or a named tuple, not %r'
+    raise TypeError(msg % (target,))
+
+
+class _ParseTemplate(object):
+    """What parse_known_args() needs to know about a parser's actions.
+
+    Templates are built once per revision of the parser: the defaults to
+    install in new namespaces, the actions whose string defaults may need
+    converting, with the conversions of pure type functions done ahead of
+    time, the required actions, the actions with default factories and the
+    conflicts between actions in mutually exclusive groups.
+    """
+
+    def __init__(self, parser):
+        self.revision = parser._revision[0]
+
+        # the first action with a default for a dest provides it, and the
+        # parser defaults fill in the rest
+        self.defaults = {}
+        for action in parser._actions:
+            if action.dest is not SUPPRESS and action.default is not SUPPRESS:
+                if action.default_factory is not None:
+                    continue
+                if action.dest not in self.defaults:
+                    self.defaults[action.dest] = action.default
+        for dest in parser._defaults:
+            if dest not in self.defaults:
+                self.defaults[dest] = parser._defaults[dest]
+
+        # the members of flag groups are stored as the bits of one integer
+        # by the namespaces generated for the parser, if they have bool
+        # defaults and no other actions share their dests
+        flag_actions = set()
+        for group in parser._flag_groups:
+            flag_actions.update(group._group_actions)
+        other_dests = set([action.dest
+                           for action in parser._actions
+                           if action not in flag_actions])
+        flag_defaults = {}
+        for group in parser._flag_groups:
+            for action in group._group_actions:
+                dest = action.dest
+                if (dest not in other_dests and dest not in flag_defaults and
+                    type(self.defaults.get(dest)) is bool and
+                    not dest.startswith('__') and
+                    not hasattr(_SlotsNamespace, dest)):
+                    flag_defaults[dest] = self.defaults[dest]
+        self.flag_names = tuple(flag_defaults)
+        self.flag_bits = 0
+        self.flag_mask = (1 << len(self.flag_names)) - 1
+        for i, dest in enumerate(self.flag_names):
+            if flag_defaults[dest]:
+                self.flag_bits |= 1 << i
+        self.other_defaults = dict([
+            (dest, value)
+            for dest, value in self.defaults.items()
+            if dest not in flag_defaults])
+
+        # a new Namespace already has the names of its own attributes
+        self.namespace_defaults = dict([
+            (dest, value)
+            for dest, value in self.defaults.items()
+            if not hasattr(Namespace, dest)])
+
+        # string defaults are converted after parsing, if still present;
+        # the results of int, float, complex, str and cached conversions
+        # are kept, with the default itself as a placeholder for the rest
+        self.string_defaults = []
+        for action in parser._actions:
+            default = action.default
+            if isinstance(default, str) and not action.required:
+                converted = default
+                type_func = action.conversion_cache
+                if type_func is None:
+                    type_func = parser._registry_get('type', action.type,
+                                                     action.type)
+                    if type_func not in (int, float, complex, str):
+                        type_func = None
+                if type_func is not None:
+                    try:
+                        converted = type_func(default)
+                    except (ArgumentTypeError, TypeError, ValueError):
+                        pass
+                    else:
+                        if isinstance(converted, _collections_abc.Awaitable):
+                            converted.close()
+                            converted = default
+                self.string_defaults.append((action, converted))
+
+        self.required_actions = [action
+                                 for action in parser._actions
+                                 if action.required]
+        self.default_factories = [action
+                                  for action in parser._actions
+                                  if action.default_factory is not None and
+                                     action.dest is not SUPPRESS]
+        self.has_positionals = any([not action.option_strings
+                                    for action in parser._actions])
+
+        # map all mutually exclusive arguments to the other arguments
+        # they can't occur with
+        self.action_conflicts = {}
+        for mutex_group in parser._mutually_exclusive_groups:
+            group_actions = mutex_group._group_actions
+            for i, mutex_action in enumerate(mutex_group._group_actions):
+                conflicts = self.action_conflicts.setdefault(mutex_action, [])
+                conflicts.extend(group_actions[:i])
+                conflicts.extend(group_actions[i + 1:])
+
+
+def _make_slots_namespace_class(dests, flag_names=()):
+    # dests that cannot be slots are stored in the instance dictionary,
+    # and flags in the bits of _flag_bits
+    slots = []
+    for dest in dests:
+        if (dest.isidentifier() and not dest.startswith('__') and
+            not hasattr(_SlotsNamespace, dest) and dest not in slots and
+            dest not in flag_names):
+            slots.append(dest)
+    attrs = {'__slots__': tuple(slots)}
+    if flag_names:
+        attrs['_flag_names'] = flag_names
+        for i, name in enumerate(flag_names):
+            attrs[name] = _FlagDescriptor(name, 1 << i)
+    return type('Namespace', (_SlotsNamespace,), attrs)
+
+
+# a list of numbers stored in a shared memory block by share_namespace()
+_SharedArray = _collections.namedtuple('_SharedArray',
+                                       'block offset typecode length')
+
+# the shared memory blocks attached by unpack_namespace() in this process,
+# by name, as [block, address, arrays] lists counting the arrays read from
+# them that are still in use; each is closed once the last of them is gone
+_attached_blocks = {}
+
+
+def _shared_array_typecode(value):
+    # the array typecode to share a list of numbers as, or None
+    if type(value) is not list or len(value) < _SHARED_ARRAY_MIN_LENGTH:
+        return None
+    first_type = type(value[0])
+    if first_type is int:
+        typecode = 'q'
+    elif first_type is float:
+        typecode = 'd'
+    else:
+        return None
+    for item in value:
+        if type(item) is not first_type:
+            return None
+    return typecode
+
+
+def _read_shared_array(shared):
+    import ctypes as _ctypes
+    import weakref as _weakref
+    entry = _attached_blocks.get(shared.block)
+    if entry is None:
+        from multiprocessing import shared_memory as _shared_memory
+        block = _shared_memory.SharedMemory(shared.block)
+        address = _ctypes.addressof(_ctypes.c_char.from_buffer(block.buf))
+        entry = _attached_blocks.setdefault(shared.block,
+                                            [block, address, 0])
+    entry[2] += 1
+
+    # the array is read through a ctypes array at its address rather than
+    # a slice of the block's buffer, so that the memoryview returned, and
+    # any views made from it, keep only that ctypes array alive, and the
+    # block can be closed when it is gone
+    size = shared.length * 8
+    items = (_ctypes.c_char * size).from_address(entry[1] + shared.offset)
+    _weakref.finalize(items, _release_shared_block, shared.block, entry)
+    return memoryview(items).cast('B').cast(shared.typecode).toreadonly()
+
+
+def _release_shared_block(name, entry):
+    # called when an array read from a block is no longer in use
+    entry[2] -= 1
+    if not entry[2]:
+        if _attached_blocks.get(name) is entry:
+            del _attached_blocks[name]
+        entry[0].close()
+
+
 class _ActionsContainer(object):
 
     def __init__(self,
@@ -1229,6 +2158,7 @@ class _ActionsContainer(object):
         self.register('action', 'store_false', _StoreFalseAction)
         self.register('action', 'append', _AppendAction)
         self.register('action', 'append_const', _AppendConstAction)
+        self.register('action', 'extend', _ExtendAction)
         self.register('action', 'count', _CountAction)
         self.register('action', 'help', _HelpAction)
         self.register('action', 'version', _VersionAction)
@@ -1244,6 +2174,7 @@ class _ActionsContainer(object):
         # groups
         self._action_groups = []
         self._mutually_exclusive_groups = []
+        self._flag_groups = []
 
         # defaults storage
         self._defaults = {}
@@ -1255,6 +2186,10 @@ class _ActionsContainer(object):
         # numbers -- uses a list so it can be shared and edited
         self._has_negative_number_optionals = []
 
+        # incremented whenever actions or defaults change, so that anything
+        # derived from them can be cached -- uses a list so it can be shared
+        self._revision = [0]
+
     # ====================
     # Registration methods
     # ====================
@@ -1270,12 +2205,16 @@ class _ActionsContainer(object):
     # ==================================
     def set_defaults(self, **kwargs):
         self._defaults.update(kwargs)
+        self._revision[0] += 1
 
         # if these defaults match any existing arguments, replace
-        # the previous default on the object with the new one
+        # the previous default (or default factory) on the object with
+        # the new one
         for action in self._actions:
             if action.dest in kwargs:
                 action.default = kwargs[action.dest]
+                if action.default_factory is not None:
+                    action.default_factory = None
 
     def get_default(self, dest):
         for action in self._actions:
@@ -1306,6 +2245,15 @@ class _ActionsContainer(object):
         else:
             kwargs = self._get_optional_kwargs(*args, **kwargs)
 
+        # default factories are called after parsing instead of defaults
+        default_factory = kwargs.pop('default_factory', None)
+        if default_factory is not None:
+            if 'default' in kwargs:
+                raise ValueError('cannot specify both default and '
+                                 'default_factory')
+            if not callable(default_factory):
+                raise ValueError('%r is not callable' % (default_factory,))
+
         # if no default was supplied, use the parser-level default
         if 'default' not in kwargs:
             dest = kwargs['dest']
@@ -1314,6 +2262,13 @@ class _ActionsContainer(object):
             elif self.argument_default is not None:
                 kwargs['default'] = self.argument_default
 
+        # the conversion cache is handled here rather than by the action
+        cache = kwargs.pop('cache', False)
+
+        # enums and mappings are looked up by name through a LookupType
+        if _is_lookup_source(kwargs.get('type')):
+            kwargs['type'] = LookupType(kwargs['type'])
+
         # create the action object, and add it to the parser
         action_class = self._pop_action_class(kwargs)
         if not callable(action_class):
@@ -1325,6 +2280,26 @@ class _ActionsContainer(object):
         if not callable(type_func):
             raise ValueError('%r is not callable' % (type_func,))
 
+        # memoise the conversions of pure type functions in a bounded cache
+        if cache:
+            if cache is True:
+                cache = _DEFAULT_CONVERSION_CACHE_SIZE
+            if not isinstance(cache, int) or cache < 1:
+                raise ValueError('cache must be True or a positive int, '
+                                 'not %r' % (cache,))
+
+            # a coroutine can only be awaited once, so caching it would
+            # break every later conversion of the same string
+            import inspect as _inspect
+            if _inspect.iscoroutinefunction(type_func):
+                raise ValueError('cache cannot be used with coroutine '
+                                 'function %r' % (type_func,))
+            action.conversion_cache = _functools.lru_cache(cache)(type_func)
+        action.default_factory = default_factory
+
+        # index long tuples of choices so that membership checks are cheap
+        action._choices_index = _index_choices(action.choices)
+
         # raise an error if the metavar does not match the type
         if hasattr(self, "_get_formatter"):
             try:
@@ -1337,6 +2312,7 @@ class _ActionsContainer(object):
     def add_argument_group(self, *args, **kwargs):
         group = _ArgumentGroup(self, *args, **kwargs)
         self._action_groups.append(group)
+        self._revision[0] += 1
         return group
 
     def add_mutually_exclusive_group(self, **kwargs):
@@ -1344,6 +2320,11 @@ class _ActionsContainer(object):
         self._mutually_exclusive_groups.append(group)
         return group
 
+    def add_flag_group(self):
+        group = _FlagGroup(self)
+        self._flag_groups.append(group)
+        return group
+
     def _add_action(self, action):
         # resolve any conflicts
         self._check_conflict(action)
@@ -1352,6 +2333,14 @@ class _ActionsContainer(object):
         self._actions.append(action)
         action.container = self
 
+        # remember the revision of each parser holding the action, which
+        # changes to the action invalidate
+        revisions = action.__dict__.get('_revisions')
+        if revisions is None:
+            revisions = action._revisions = []
+        if not any([revision is self._revision for revision in revisions]):
+            revisions.append(self._revision)
+
         # index the action by any option strings it has
         for option_string in action.option_strings:
             self._option_string_actions[option_string] = action
@@ -1361,12 +2350,14 @@ class _ActionsContainer(object):
             if self._negative_number_matcher.match(option_string):
                 if not self._has_negative_number_optionals:
                     self._has_negative_number_optionals.append(True)
+        self._revision[0] += 1
 
         # return the created action
         return action
 
     def _remove_action(self, action):
         self._actions.remove(action)
+        self._revision[0] += 1
 
     def _add_container_actions(self, container):
         # collect groups by titles
@@ -1404,6 +2395,12 @@ class _ActionsContainer(object):
             for action in group._group_actions:
                 group_map[action] = mutex_group
 
+        # add container's flag groups
+        for group in container._flag_groups:
+            flag_group = self.add_flag_group()
+            for action in group._group_actions:
+                group_map[action] = flag_group
+
         # add all actions to this container or their group
         for action in container._actions:
             group_map.get(action, self)._add_action(action)
@@ -1534,6 +2531,8 @@ class _ArgumentGroup(_ActionsContainer):
         self._has_negative_number_optionals = \
             container._has_negative_number_optionals
         self._mutually_exclusive_groups = container._mutually_exclusive_groups
+        self._flag_groups = container._flag_groups
+        self._revision = container._revision
 
     def _add_action(self, action):
         action = super(_ArgumentGroup, self)._add_action(action)
@@ -1565,6 +2564,26 @@ class _MutuallyExclusiveGroup(_ArgumentGroup):
         self._group_actions.remove(action)
 
 
+class _FlagGroup(_ArgumentGroup):
+
+    def __init__(self, container):
+        super(_FlagGroup, self).__init__(container)
+        self._container = container
+
+    def _add_action(self, action):
+        if not isinstance(action, (_StoreTrueAction, _StoreFalseAction)):
+            msg = _('flag groups may only contain store_true and '
+                    'store_false arguments')
+            raise ValueError(msg)
+        action = self._container._add_action(action)
+        self._group_actions.append(action)
+        return action
+
+    def _remove_action(self, action):
+        self._container._remove_action(action)
+        self._group_actions.remove(action)
+
+
 class ArgumentParser(_AttributeHolder, _ActionsContainer):
     """Object for parsing command line strings into Python objects.
 
@@ -1581,6 +2600,18 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         - argument_default -- The default value for all arguments
         - conflict_handler -- String indicating how to handle conflicts
         - add_help -- Add a -h/-help option
+        - conversion_executor -- A concurrent.futures.Executor that converts
+            the values of store and append actions concurrently
+        - exit_on_error -- Whether errors in the command line exit with a
+            usage message, or raise ArgumentError (default: True)
+        - namespace_class -- The class of the namespaces created by
+            parse_args(), or 'slots' for a Namespace subclass generated
+            with __slots__ for the parser's destinations
+        - repr_limit -- The number of items of each container shown by
+            format_namespace() and write_namespace(), or None to show them
+            all (default: 100)
+        - intern_table -- An InternTable that the string values and
+            unrecognized arguments of every parse are interned in
     """
 
     def __init__(self,
@@ -1594,7 +2625,12 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
                  fromfile_prefix_chars=None,
                  argument_default=None,
                  conflict_handler='error',
-                 add_help=True):
+                 add_help=True,
+                 conversion_executor=None,
+                 exit_on_error=True,
+                 namespace_class=None,
+                 repr_limit=_REPR_LIMIT,
+                 intern_table=None):
 
         superinit = super(ArgumentParser, self).__init__
         superinit(description=description,
@@ -1612,6 +2648,19 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         self.formatter_class = formatter_class
         self.fromfile_prefix_chars = fromfile_prefix_chars
         self.add_help = add_help
+        self.conversion_executor = conversion_executor
+        self.exit_on_error = exit_on_error
+        self.namespace_class = namespace_class
+        self.repr_limit = repr_limit
+        self.intern_table = intern_table
+        self._slots_namespace_class = None
+        self._help_cache = None, {}
+        self._help_snapshot = None
+        self._checked_targets = {}
+        self._parse_template = None
+
+        if isinstance(namespace_class, str) and namespace_class != 'slots':
+            raise ValueError('unknown namespace_class %r' % (namespace_class,))
 
         add_group = self.add_argument_group
         self._positionals = add_group(_('positional arguments'))
@@ -1710,14 +2759,21 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
     # =====================================
     # Command line argument parsing methods
     # =====================================
-    def parse_args(self, args=None, namespace=None):
-        args, argv = self.parse_known_args(args, namespace)
+    def parse_args(self, args=None, namespace=None, target=None,
+                   provenance=None):
+        args, argv = self.parse_known_args(args, namespace, target,
+                                           provenance)
         if argv:
             msg = _('unrecognized arguments: %s')
-            self.error(msg % ' '.join(argv))
+            self._report_error(ArgumentError(None, msg % ' '.join(argv)))
         return args
 
-    def parse_known_args(self, args=None, namespace=None):
+    def parse_known_args(self, args=None, namespace=None, target=None,
+                         provenance=None):
+        # make sure that the destinations match the fields of the target
+        if target is not None:
+            self._check_target(target)
+
         if args is None:
             # args default to the system args
             args = _sys.argv[1:]
@@ -1725,47 +2781,194 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
             # make sure that args are mutable
             args = list(args)
 
+        # values already in a given namespace take precedence over defaults
+        if provenance is not None:
+            provenance._sources.clear()
+            if namespace is not None:
+                for dest in vars(namespace):
+                    provenance._record(dest, FROM_NAMESPACE)
+
         # default Namespace built from parser defaults
+        template = self._get_parse_template()
         if namespace is None:
-            namespace = Namespace()
-
-        # add any action defaults that aren't present
-        for action in self._actions:
-            if action.dest is not SUPPRESS:
-                if not hasattr(namespace, action.dest):
-                    if action.default is not SUPPRESS:
-                        setattr(namespace, action.dest, action.default)
+            namespace = self._new_namespace(template, target)
+        else:
+            self._add_defaults(namespace, template)
 
-        # add any parser defaults that aren't present
-        for dest in self._defaults:
-            if not hasattr(namespace, dest):
-                setattr(namespace, dest, self._defaults[dest])
+        # values converted by the executor are collected after parsing,
+        # unless an enclosing parse is already deferring conversions
+        if (self.conversion_executor is None or
+            _deferred_conversions.get() is not None):
+            parse = self._parse_known_args
+        else:
+            parse = self._parse_known_args_concurrently
 
         # parse the arguments and exit if there are any errors
+        token = _owned_lists.set({})
+        if provenance is not None:
+            provenance_token = _provenance.set(provenance)
+        intern_table = self.intern_table
+        if intern_table is not None:
+            intern_token = _intern_table.set(intern_table)
         try:
-            namespace, args = self._parse_known_args(args, namespace)
+            namespace, args = parse(args, namespace)
             if hasattr(namespace, _UNRECOGNIZED_ARGS_ATTR):
                 args.extend(getattr(namespace, _UNRECOGNIZED_ARGS_ATTR))
                 delattr(namespace, _UNRECOGNIZED_ARGS_ATTR)
-            return namespace, args
+            if intern_table is not None:
+                args = list(map(intern_table.intern, args))
         except ArgumentError:
-            err = _sys.exc_info()[1]
-            self.error(str(err))
+            self._report_error(_sys.exc_info()[1])
+        else:
+            # build the target record from the collected values, unless an
+            # enclosing parse still has to convert some of them
+            if target is not None and _deferred_conversions.get() is None:
+                namespace = self._build_record(target, vars(namespace))
+            return namespace, args
+        finally:
+            _owned_lists.reset(token)
+            if provenance is not None:
+                _provenance.reset(provenance_token)
+            if intern_table is not None:
+                _intern_table.reset(intern_token)
+
+    def _check_target(self, target):
+        # the check is repeated only when the actions or defaults change
+        checked = self._checked_targets.get(target)
+        if checked is not None and checked[0] == self._revision[0]:
+            return checked[1]
+        fields = _get_record_fields(target)
+        names = frozenset([name for name, required in fields])
+
+        # every destination that may be set, including those of subparsers
+        # and those with suppressed defaults, needs a field to be stored
+        # in; help and version actions exit rather than store anything
+        always_set = set(self._defaults)
+        may_be_set = set()
+        for parser in self._get_parsers():
+            may_be_set.update(parser._defaults)
+            for action in parser._actions:
+                if (action.dest is SUPPRESS or
+                    isinstance(action, (_HelpAction, _VersionAction))):
+                    continue
+                may_be_set.add(action.dest)
+                if parser is self and action.default is not SUPPRESS:
+                    always_set.add(action.dest)
+        unknown = sorted((always_set | may_be_set) - names)
+        if unknown:
+            msg = 'no fields of %s for destinations: %s'
+            raise ValueError(msg % (target.__name__, ', '.join(unknown)))
+
+        # and fields without defaults need a destination that is always set
+        missing = [name
+                   for name, required in fields
+                   if required and name not in always_set]
+        if missing:
+            msg = 'fields of %s that may not be set: %s'
+            raise ValueError(msg % (target.__name__, ', '.join(missing)))
+        self._checked_targets[target] = self._revision[0], names
+        return names
+
+    def _build_record(self, target, values):
+        # values stored by custom actions or present in the namespace
+        # passed in are not covered by the check made before parsing
+        names = self._check_target(target)
+        if not names.issuperset(values):
+            unknown = sorted(set(values) - names)
+            msg = 'no fields of %s for destinations: %s'
+            raise ValueError(msg % (target.__name__, ', '.join(unknown)))
+        return target(**values)
+
+    def _new_namespace(self, template, target=None):
+        # the values of a target record are collected in a flat buffer
+        if target is not None:
+            return _RecordBuffer(dict(template.defaults))
+
+        # new Namespaces take all the defaults in a single update
+        namespace = self._make_namespace()
+        if type(namespace) is Namespace:
+            namespace.__dict__.update(template.namespace_defaults)
+        else:
+            self._add_defaults(namespace, template)
+        return namespace
+
+    def _get_parse_template(self):
+        template = self._parse_template
+        if template is None or template.revision != self._revision[0]:
+            template = self._parse_template = _ParseTemplate(self)
+        return template
+
+    def _add_defaults(self, namespace, template):
+        # namespaces generated for the parser's flags take the defaults of
+        # the flags they don't have in a single assignment
+        defaults = template.defaults
+        flag_names = template.flag_names
+        if flag_names:
+            if getattr(type(namespace), '_flag_names', None) is flag_names:
+                defaults = template.other_defaults
+                flag_set = getattr(namespace, '_flag_set', 0)
+                missing = template.flag_mask & ~flag_set
+                if missing:
+                    bits = getattr(namespace, '_flag_bits', 0)
+                    namespace._flag_bits = (bits & ~missing |
+                                            template.flag_bits & missing)
+                    namespace._flag_set = flag_set | missing
+
+        # add any action and parser defaults that aren't present
+        for dest, value in defaults.items():
+            if not hasattr(namespace, dest):
+                setattr(namespace, dest, value)
+
+    def _make_namespace(self):
+        namespace_class = self.namespace_class
+        flag_names = self._get_parse_template().flag_names
+        if namespace_class is None and not flag_names:
+            return Namespace()
+        if namespace_class is not None and namespace_class != 'slots':
+            return namespace_class()
+
+        # the slots class is regenerated when the destinations may change,
+        # and a class without slots is generated for flags
+        cached = self._slots_namespace_class
+        key = self._revision[0]
+        if cached is None or cached[0] != key:
+            dests = []
+            if namespace_class is not None:
+                dests = [action.dest
+                         for action in self._actions
+                         if action.dest is not SUPPRESS]
+                dests.extend(self._defaults)
+            namespace_class = _make_slots_namespace_class(dests, flag_names)
+            cached = key, namespace_class
+            self._slots_namespace_class = cached
+        return cached[1]()
+
+    def _parse_known_args_concurrently(self, arg_strings, namespace):
+        deferred = _DeferredConversions(self.conversion_executor)
+        token = _deferred_conversions.set(deferred)
+        try:
+            namespace, extras = self._parse_known_args(arg_strings, namespace)
+            self._apply_deferred(namespace, deferred, deferred.results())
+        finally:
+            _deferred_conversions.reset(token)
+            deferred.cancel()
+        return namespace, extras
 
     def _parse_known_args(self, arg_strings, namespace):
         # replace arg strings that are file references
         if self.fromfile_prefix_chars is not None:
             arg_strings = self._read_args_from_files(arg_strings)
 
+        # without arguments or positionals to fill in, only the defaults
+        # and required actions need checking
+        template = self._get_parse_template()
+        if not arg_strings and not template.has_positionals:
+            self._check_missing_actions(namespace, template, set(), set())
+            return namespace, []
+
         # map all mutually exclusive arguments to the other arguments
         # they can't occur with
-        action_conflicts = {}
-        for mutex_group in self._mutually_exclusive_groups:
-            group_actions = mutex_group._group_actions
-            for i, mutex_action in enumerate(mutex_group._group_actions):
-                conflicts = action_conflicts.setdefault(mutex_action, [])
-                conflicts.extend(group_actions[:i])
-                conflicts.extend(group_actions[i + 1:])
+        action_conflicts = template.action_conflicts
 
         # find all option indices, and determine the arg_string_pattern
         # which has an 'O' if there is an option at an index,
@@ -1799,14 +3002,19 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         seen_actions = set()
         seen_non_default_actions = set()
 
+        # occurrences of actions with an apply_batch method, by action
+        batches = {}
+
         def take_action(action, argument_strings, option_string=None):
             seen_actions.add(action)
             argument_values = self._get_values(action, argument_strings)
 
             # error if this argument is not allowed with other previously
-            # seen arguments, assuming that actions that use the default
-            # value don't really count as "present"
-            if argument_values is not action.default:
+            # seen arguments; options always count as "present", but
+            # positionals only when they consumed some strings, since
+            # comparing the values with the default by identity also
+            # matches equal interned values like small ints
+            if action.option_strings or argument_strings:
                 seen_non_default_actions.add(action)
                 for conflict_action in action_conflicts.get(action, []):
                     if conflict_action in seen_non_default_actions:
@@ -1815,9 +3023,13 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
                         raise ArgumentError(action, msg % action_name)
 
             # take the action if we didn't receive a SUPPRESS value
-            # (e.g. from a default)
+            # (e.g. from a default), or save it for the action's batch
             if argument_values is not SUPPRESS:
-                action(self, namespace, argument_values, option_string)
+                if action.apply_batch is not None:
+                    occurrence = argument_values, option_string
+                    batches.setdefault(action, []).append(occurrence)
+                else:
+                    action(self, namespace, argument_values, option_string)
 
         # function to convert arg_strings into an optional action
         def consume_optional(start_index):
@@ -1923,13 +3135,17 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
             max_option_string_index = max(option_string_indices)
         else:
             max_option_string_index = -1
+
+        # the option indices were found in order, and start_index only
+        # grows, so the next option is found by advancing a position
+        sorted_option_string_indices = list(option_string_indices)
+        position = 0
         while start_index <= max_option_string_index:
 
             # consume any Positionals preceding the next option
-            next_option_string_index = min([
-                index
-                for index in option_string_indices
-                if index >= start_index])
+            while sorted_option_string_indices[position] < start_index:
+                position += 1
+            next_option_string_index = sorted_option_string_indices[position]
             if start_index != next_option_string_index:
                 positionals_end_index = consume_positionals(start_index)
 
@@ -1957,28 +3173,38 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         # if we didn't consume all the argument strings, there were extras
         extras.extend(arg_strings[stop_index:])
 
-        # make sure all required actions were present and also convert
-        # action defaults which were not given as arguments
-        required_actions = []
-        for action in self._actions:
-            if action not in seen_actions:
-                if action.required:
-                    required_actions.append(_get_action_name(action))
-                else:
-                    # Convert action default now instead of doing it before
-                    # parsing arguments to avoid calling convert functions
-                    # twice (which may fail) if the argument was given, but
-                    # only if it was defined already in the namespace
-                    if (action.default is not None and
-                        isinstance(action.default, str) and
-                        hasattr(namespace, action.dest) and
-                        action.default is getattr(namespace, action.dest)):
-                        setattr(namespace, action.dest,
-                                self._get_value(action, action.default))
+        # apply the batched occurrences, in order of each action's first
+        for action, occurrences in batches.items():
+            action.apply_batch(self, namespace, occurrences)
+
+        # check the actions that were not given, and return the updated
+        # namespace and the extra arguments
+        self._check_missing_actions(namespace, template, seen_actions,
+                                    seen_non_default_actions)
+        return namespace, extras
 
+    def _check_missing_actions(self, namespace, template, seen_actions,
+                               seen_non_default_actions):
+        # convert action defaults which were not given as arguments
+        for action, converted in template.string_defaults:
+            if action not in seen_actions:
+                # Convert action default now instead of doing it before
+                # parsing arguments to avoid calling convert functions
+                # twice (which may fail) if the argument was given, but
+                # only if it was defined already in the namespace
+                if (hasattr(namespace, action.dest) and
+                    action.default is getattr(namespace, action.dest)):
+                    if converted is action.default:
+                        converted = self._get_value(action, action.default)
+                    setattr(namespace, action.dest, converted)
+
+        # make sure all required actions were present
+        required_actions = [_get_action_name(action)
+                            for action in template.required_actions
+                            if action not in seen_actions]
         if required_actions:
-            self.error(_('the following arguments are required: %s') %
-                       ', '.join(required_actions))
+            msg = _('the following arguments are required: %s')
+            raise ArgumentError(None, msg % ', '.join(required_actions))
 
         # make sure all required groups had one option present
         for group in self._mutually_exclusive_groups:
@@ -1993,10 +3219,131 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
                              for action in group._group_actions
                              if action.help is not SUPPRESS]
                     msg = _('one of the arguments %s is required')
-                    self.error(msg % ' '.join(names))
+                    raise ArgumentError(None, msg % ' '.join(names))
+
+        # call the default factories of actions that were not given, unless
+        # something else has set their dest in the meantime; this is done
+        # last so that no factory runs for a command line that is rejected
+        for action in template.default_factories:
+            if action not in seen_non_default_actions:
+                value = getattr(namespace, action.dest, action.default)
+                if value is action.default:
+                    setattr(namespace, action.dest, action.default_factory())
+
+        # record where the values of the destinations came from
+        provenance = _provenance.get()
+        if provenance is not None:
+            for action in self._actions:
+                if action.dest is SUPPRESS:
+                    continue
+                if action in seen_non_default_actions:
+                    provenance._record(action.dest, FROM_COMMAND_LINE)
+                elif hasattr(namespace, action.dest):
+                    provenance._record(action.dest, FROM_DEFAULT)
+            for dest in self._defaults:
+                if hasattr(namespace, dest):
+                    provenance._record(dest, FROM_DEFAULT)
+
+    async def parse_args_async(self, args=None, namespace=None,
+                               max_concurrency=None, target=None,
+                               provenance=None):
+        """parse_args_async(args=None, namespace=None, max_concurrency=None,
+                            target=None, provenance=None)
+
+        Coroutine version of parse_args() that also accepts coroutine
+        functions as argument types. See parse_known_args_async().
+        """
+        args, argv = await self.parse_known_args_async(args, namespace,
+                                                       max_concurrency, target,
+                                                       provenance)
+        if argv:
+            msg = _('unrecognized arguments: %s')
+            self._report_error(ArgumentError(None, msg % ' '.join(argv)))
+        return args
 
-        # return the updated namespace and the extra arguments
-        return namespace, extras
+    async def parse_known_args_async(self, args=None, namespace=None,
+                                     max_concurrency=None, target=None,
+                                     provenance=None):
+        """parse_known_args_async(args=None, namespace=None,
+                               max_concurrency=None, target=None,
+                               provenance=None)
+
+        Coroutine version of parse_known_args(). Awaitables returned by
+        the type functions of store and append actions are awaited
+        concurrently once the command line has been parsed, at most
+        max_concurrency of them at a time, and the results are stored in
+        the namespace in their place.
+        """
+        import asyncio as _asyncio
+
+        # make sure that the destinations match the fields of the target
+        if target is not None:
+            self._check_target(target)
+
+        # parse the command line, collecting the pending conversions
+        deferred = _DeferredConversions()
+        token = _deferred_conversions.set(deferred)
+        try:
+            namespace, args = self.parse_known_args(args, namespace, target,
+                                                    provenance)
+        except BaseException:
+            deferred.cancel()
+            raise
+        finally:
+            _deferred_conversions.reset(token)
+
+        # await the conversions, limiting how many run at a time
+        if max_concurrency is None:
+            semaphore = None
+        else:
+            semaphore = _asyncio.Semaphore(max_concurrency)
+
+        async def convert(value):
+            try:
+                if semaphore is None:
+                    return None, await value.pending
+                async with semaphore:
+                    return None, await value.pending
+            except Exception:
+                return _sys.exc_info()[1], None
+
+        results = await _asyncio.gather(*map(convert, deferred.values))
+
+        # store the converted values and exit if there are any errors
+        try:
+            self._apply_deferred(namespace, deferred, results)
+        except ArgumentError:
+            self._report_error(_sys.exc_info()[1])
+
+        # build the target record once the values have been converted
+        if target is not None:
+            namespace = self._build_record(target, vars(namespace))
+        return namespace, args
+
+    def _apply_deferred(self, namespace, deferred, results):
+        # check the results in argument order, so that the first failed
+        # conversion on the command line is the one that is reported
+        dests = []
+        for value, (error, result) in zip(deferred.values, results):
+            action = value.action
+            if error is not None:
+                if isinstance(error, (ArgumentTypeError, TypeError,
+                                      ValueError)):
+                    raise self._conversion_error(action, value.arg_string,
+                                                 error)
+                raise error
+            if type(result) is str and value.intern_table is not None:
+                result = value.intern_table.intern(result)
+            if value.check:
+                self._check_value(action, result)
+            value.result = result
+            if action.dest not in dests:
+                dests.append(action.dest)
+
+        # replace the placeholders in the namespace by the results
+        for dest in dests:
+            values = getattr(namespace, dest, None)
+            setattr(namespace, dest, _resolve_deferred_values(values))
 
     def _read_args_from_files(self, arg_strings):
         # expand arguments referencing files
@@ -2019,7 +3366,7 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
                         new_arg_strings.extend(arg_strings)
                 except OSError:
                     err = _sys.exc_info()[1]
-                    self.error(str(err))
+                    raise ArgumentError(None, str(err))
 
         # return the modified argument list
         return new_arg_strings
@@ -2099,7 +3446,7 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
                 for action, option_string, explicit_arg in option_tuples])
             args = {'option': arg_string, 'matches': options}
             msg = _('ambiguous option: %(option)s could match %(matches)s')
-            self.error(msg % args)
+            raise ArgumentError(None, msg % args)
 
         # if exactly one action matched, this segmentation is good,
         # so return the parsed action
@@ -2161,7 +3508,8 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
 
         # shouldn't ever get here
         else:
-            self.error(_('unexpected option string: %s') % option_string)
+            msg = _('unexpected option string: %s')
+            raise ArgumentError(None, msg % option_string)
 
         # return the collected option tuples
         return result
@@ -2232,6 +3580,9 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         # args, use the default if it is anything other than None
         elif (not arg_strings and action.nargs == ZERO_OR_MORE and
               not action.option_strings):
+            if action.default_factory is not None:
+                # the default factory is called once parsing is done
+                return action.default
             if action.default is not None:
                 value = action.default
             else:
@@ -2263,51 +3614,376 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
         return value
 
     def _get_value(self, action, arg_string):
-        type_func = self._registry_get('type', action.type, action.type)
+        type_func = action.conversion_cache
+        if type_func is None:
+            type_func = self._registry_get('type', action.type, action.type)
         if not callable(type_func):
             msg = _('%r is not callable')
             raise ArgumentError(action, msg % type_func)
 
-        # convert the value to the appropriate type
+        # values that are only stored can be converted by the executor
+        deferred = _deferred_conversions.get()
+        stored = (isinstance(action, (_StoreAction, _AppendAction)) and
+                  action.apply_batch is None)
+        if deferred is not None and deferred.executor is not None and stored:
+            future = deferred.executor.submit(type_func, arg_string)
+            return deferred.add(action, arg_string, future)
+
+        # converters with a try_convert() method report failures by
+        # returning a false flag and an error message instead of raising
+        try_convert = getattr(type_func, 'try_convert', None)
         try:
-            result = type_func(arg_string)
+            if try_convert is not None:
+                ok, result = try_convert(arg_string)
+                if not ok:
+                    raise self._conversion_error(action, arg_string, result)
 
-        # ArgumentTypeErrors indicate errors
-        except ArgumentTypeError:
-            name = getattr(action.type, '__name__', repr(action.type))
-            msg = str(_sys.exc_info()[1])
-            raise ArgumentError(action, msg)
+            # convert the value to the appropriate type
+            else:
+                result = type_func(arg_string)
 
-        # TypeErrors or ValueErrors also indicate errors
-        except (TypeError, ValueError):
-            name = getattr(action.type, '__name__', repr(action.type))
-            args = {'type': name, 'value': arg_string}
-            msg = _('invalid %(type)s value: %(value)r')
-            raise ArgumentError(action, msg % args)
+        # ArgumentTypeErrors, TypeErrors or ValueErrors indicate errors,
+        # whether raised by the type function or by try_convert()
+        except (ArgumentTypeError, TypeError, ValueError):
+            err = _sys.exc_info()[1]
+            raise self._conversion_error(action, arg_string, err)
+
+        # strings are shared with earlier parses through the intern table
+        if type(result) is str:
+            intern_table = _intern_table.get()
+            if intern_table is not None:
+                return intern_table.intern(result)
+
+        # awaitables are awaited once the command line has been parsed, if
+        # the values are only stored
+        if (deferred is not None and deferred.executor is None and
+            isinstance(result, _collections_abc.Awaitable)):
+            value = deferred.add(action, arg_string, result)
+            if not stored:
+                msg = _('awaitable values require a store or append action')
+                raise ArgumentError(action, msg)
+            if type_func is action.conversion_cache:
+                type_func.cache_clear()
+                msg = _('cached type functions cannot return awaitables')
+                raise ArgumentError(action, msg)
+            return value
 
         # return the converted value
         return result
 
+    def _conversion_error(self, action, arg_string, error):
+        # ArgumentTypeErrors and try_convert() failures carry their own
+        # message
+        if isinstance(error, (ArgumentTypeError, str)):
+            msg = str(error)
+
+        # TypeErrors, ValueErrors and failures without a message get a
+        # generic message
+        else:
+            name = getattr(action.type, '__name__', repr(action.type))
+            args = {'type': name, 'value': arg_string}
+            msg = _('invalid %(type)s value: %(value)r') % args
+        return ArgumentError(action, msg)
+
     def _check_value(self, action, value):
         # converted value must be one of the choices (if specified)
-        if action.choices is not None and value not in action.choices:
-            args = {'value': value,
-                    'choices': ', '.join(map(repr, action.choices))}
-            msg = _('invalid choice: %(value)r (choose from %(choices)s)')
-            raise ArgumentError(action, msg % args)
+        if action.choices is not None:
+
+            # values that are still being converted are checked afterwards
+            if isinstance(value, _DeferredValue):
+                value.check = True
+
+            elif not self._is_choice(action, value):
+                args = {'value': value,
+                        'choices': _format_choices(action.choices, repr)}
+                msg = _('invalid choice: %(value)r (choose from %(choices)s)')
+                raise ArgumentError(action, msg % args)
+
+    def _is_choice(self, action, value):
+        # use the index built by add_argument, rebuilding it if the choices
+        # have been replaced since; misses are confirmed against the choices
+        # themselves
+        choices = action.choices
+        index = action._choices_index
+        if index is None or index[0] is not choices:
+            index = action._choices_index = _index_choices(choices)
+        if index[1] is not None:
+            try:
+                if value in index[1]:
+                    return True
+            except TypeError:
+                pass
+        return value in choices
+
+    # ============================
+    # Namespace formatting methods
+    # ============================
+    def format_namespace(self, namespace):
+        """format_namespace(namespace)
+
+        Return the repr of a namespace, showing at most repr_limit items of
+        each container among its values.
+        """
+        pieces = []
+        _write_value_repr(pieces.append, namespace, self.repr_limit, set())
+        return ''.join(pieces)
+
+    def write_namespace(self, namespace, file):
+        """write_namespace(namespace, file)
+
+        Write the text returned by format_namespace() to a file piece by
+        piece, without building the whole string first.
+        """
+        _write_value_repr(file.write, namespace, self.repr_limit, set())
+
+    # ==========================
+    # Namespace transfer methods
+    # ==========================
+    def pack_namespace(self, namespace):
+        """pack_namespace(namespace)
+
+        Return a compact form of a namespace returned by parse_args(), for
+        sending to other processes that build the same parser. The values
+        are kept in the order of the parser's destinations, without their
+        names, and unpack_namespace() restores them.
+        """
+        schema = self._get_namespace_schema()
+        values = dict(vars(namespace))
+        packed_values = tuple([values.pop(dest, SUPPRESS)
+                               for dest in schema[1]])
+        return schema[0], packed_values, values or None
+
+    def share_namespace(self, namespace):
+        """share_namespace(namespace)
+
+        Like pack_namespace(), but lists of ints or floats with at least
+        256 items are copied into a multiprocessing.shared_memory block
+        and read in place by unpack_namespace(), which returns them as
+        read-only memoryviews. Returns a (packed, block) pair; the block
+        is None if no values were shared, and otherwise should be closed
+        and unlinked by the caller once the namespace has been unpacked.
+        Processes that unpack it close their own mapping of the block once
+        the memoryviews read from it, and any views of them, are gone.
+        """
+        import array as _array
+        fingerprint, values, extras = self.pack_namespace(namespace)
+
+        # collect the lists of numbers that fit in 64 bits
+        arrays = []
+        for i, value in enumerate(values):
+            typecode = _shared_array_typecode(value)
+            if typecode is not None:
+                try:
+                    arrays.append((i, _array.array(typecode, value)))
+                except OverflowError:
+                    pass
+        if not arrays:
+            return (fingerprint, values, extras), None
+
+        # copy them into a single block, one after the other
+        from multiprocessing import shared_memory as _shared_memory
+        size = sum([len(items) * 8 for i, items in arrays])
+        block = _shared_memory.SharedMemory(create=True, size=size)
+        values = list(values)
+        offset = 0
+        for i, items in arrays:
+            end = offset + len(items) * 8
+            block.buf[offset:end] = memoryview(items).cast('B')
+            values[i] = _SharedArray(block.name, offset, items.typecode,
+                                     len(items))
+            offset = end
+        return (fingerprint, tuple(values), extras), block
+
+    def unpack_namespace(self, packed, namespace=None):
+        """unpack_namespace(packed, namespace=None)
+
+        Return a namespace with the values of the result of
+        pack_namespace() or share_namespace(), which must come from a
+        parser with the same destinations.
+        """
+        fingerprint, values, extras = packed
+        schema = self._get_namespace_schema()
+        if fingerprint != schema[0] or len(values) != len(schema[1]):
+            raise ValueError('packed namespace does not match the parser')
+
+        if namespace is None:
+            namespace = self._make_namespace()
+        for dest, value in zip(schema[1], values):
+            # destinations that were not set are packed as SUPPRESS
+            if type(value) is str and value == SUPPRESS:
+                continue
+            if type(value) is _SharedArray:
+                value = _read_shared_array(value)
+            setattr(namespace, dest, value)
+        if extras:
+            for name, value in extras.items():
+                setattr(namespace, name, value)
+        return namespace
+
+    def _get_namespace_schema(self):
+        # the destinations of this parser and its subparsers, in the order
+        # they were added, with a checksum that is the same in every process
+        import zlib as _zlib
+        dests = []
+        seen_dests = set()
+        for parser in self._get_parsers():
+            names = [action.dest for action in parser._actions]
+            names.extend(parser._defaults)
+            for name in names:
+                if name is not SUPPRESS and name not in seen_dests:
+                    seen_dests.add(name)
+                    dests.append(name)
+        fingerprint = _zlib.crc32('\0'.join(dests).encode('utf-8'))
+        return fingerprint, tuple(dests)
+
+    def _get_parsers(self):
+        # this parser and the parsers of its subparsers, each once
+        parsers = [self]
+        seen_parsers = set([id(self)])
+        for parser in parsers:
+            for action in parser._get_positional_actions():
+                if isinstance(action, _SubParsersAction):
+                    for subparser in action._name_parser_map.values():
+                        if id(subparser) not in seen_parsers:
+                            seen_parsers.add(id(subparser))
+                            parsers.append(subparser)
+        return parsers
+
+    # =====================
+    # Help snapshot methods
+    # =====================
+    def write_help_snapshot(self, file, columns=(80, 100, 120, 160)):
+        """write_help_snapshot(file, columns=(80, 100, 120, 160))
+
+        Write the help and usage of this parser and all its subparsers,
+        formatted for terminals with each number of columns, to a file
+        opened in text mode. load_help_snapshot() makes the parsers of a
+        program built the same way return them without formatting.
+        Parsers whose formatter_class does not accept a width argument
+        are left out, and format their help as usual.
+        """
+        import json as _json
+        parsers = {}
+        for parser in self._get_parsers():
+            # a help and a usage formatter for each width
+            formatter_class = parser.formatter_class
+            try:
+                formatters = [(width - 2,
+                               formatter_class(prog=parser.prog,
+                                               width=width - 2),
+                               formatter_class(prog=parser.prog,
+                                               width=width - 2))
+                              for width in columns]
+            except TypeError:
+                continue
+
+            texts = {}
+            for width, help_formatter, usage_formatter in formatters:
+                help = parser._format_help(help_formatter)
+                usage_formatter.add_usage(parser.usage, parser._actions,
+                                          parser._mutually_exclusive_groups)
+                texts[str(width)] = {'help': help,
+                                     'usage': usage_formatter.format_help()}
+            parsers[parser._get_help_fingerprint()] = texts
+        snapshot = {'version': 1, 'parsers': parsers}
+        _json.dump(snapshot, file, separators=(',', ':'))
+
+    def load_help_snapshot(self, file):
+        """load_help_snapshot(file)
+
+        Read a file written by write_help_snapshot(), for this parser and
+        its subparsers to use. A parser whose actions or attributes differ
+        from those the snapshot was written for formats its help as usual.
+        """
+        import json as _json
+        snapshot = _json.load(file)
+        if not isinstance(snapshot, dict) or snapshot.get('version') != 1:
+            raise ValueError('unsupported help snapshot')
+        for parser in self._get_parsers():
+            parser._help_snapshot = snapshot['parsers']
+
+    def _get_help_snapshot(self, formatter, kind):
+        # use the text formatted for the widest terminal that is not wider
+        # than this one, if the snapshot was written for this parser
+        snapshot = self._help_snapshot
+        width = getattr(formatter, '_width', None)
+        if snapshot is None or width is None:
+            return None
+        texts = snapshot.get(self._get_help_fingerprint())
+        if texts is None:
+            return None
+        widths = [int(snapshot_width)
+                  for snapshot_width in texts
+                  if int(snapshot_width) <= width]
+        if not widths:
+            return None
+        return texts[str(max(widths))][kind]
+
+    def _get_help_fingerprint(self):
+        # a digest of everything the help depends on, which is the same in
+        # every process as long as the reprs of defaults and choices are
+        import hashlib as _hashlib
+
+        def describe(value):
+            if callable(value) and hasattr(value, '__qualname__'):
+                return '%s.%s' % (value.__module__, value.__qualname__)
+            return repr(value)
+
+        def describe_action(action):
+            return (type(action).__name__, action.option_strings,
+                    action.dest, action.nargs, describe(action.const),
+                    describe(action.default), describe(action.type),
+                    action.choices, action.required, action.help,
+                    action.metavar)
+
+        positions = dict([(action, i)
+                          for i, action in enumerate(self._actions)])
+        description = [describe(self.formatter_class), self.prog, self.usage,
+                       self.description, self.epilog]
+        for action in self._actions:
+            get_subactions = getattr(action, '_get_subactions', list)
+            subactions = [describe_action(subaction)
+                          for subaction in get_subactions()]
+            description.append((describe_action(action), subactions))
+        for group in self._action_groups:
+            description.append((group.title, group.description,
+                                [positions[action]
+                                 for action in group._group_actions]))
+        for group in self._mutually_exclusive_groups:
+            description.append((group.required,
+                                [positions[action]
+                                 for action in group._group_actions]))
+        data = repr(description).encode('utf-8', 'surrogateescape')
+        return _hashlib.sha256(data).hexdigest()
 
     # =======================
     # Help-formatting methods
     # =======================
     def format_usage(self):
         formatter = self._get_formatter()
-        formatter.add_usage(self.usage, self._actions,
-                            self._mutually_exclusive_groups)
-        return formatter.format_help()
+        cache, key = self._get_help_cache(formatter, 'usage')
+        usage = cache.get(key)
+        if usage is None:
+            usage = self._get_help_snapshot(formatter, 'usage')
+            if usage is None:
+                formatter.add_usage(self.usage, self._actions,
+                                    self._mutually_exclusive_groups)
+                usage = formatter.format_help()
+            cache[key] = usage
+        return usage
 
     def format_help(self):
         formatter = self._get_formatter()
+        cache, key = self._get_help_cache(formatter, 'help')
+        help = cache.get(key)
+        if help is None:
+            help = self._get_help_snapshot(formatter, 'help')
+            if help is None:
+                help = self._format_help(formatter)
+            cache[key] = help
+        return help
 
+    def _format_help(self, formatter):
         # usage
         formatter.add_usage(self.usage, self._actions,
                             self._mutually_exclusive_groups)
@@ -2331,6 +4007,16 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
     def _get_formatter(self):
         return self.formatter_class(prog=self.prog)
 
+    def _get_help_cache(self, formatter, kind):
+        # the formatted texts are kept until the actions, groups or defaults
+        # change, for each formatter class, width and parser attributes
+        revision = self._revision[0]
+        if self._help_cache[0] != revision:
+            self._help_cache = revision, {}
+        key = (kind, self.formatter_class, getattr(formatter, '_width', None),
+               self.prog, self.usage, self.description, self.epilog)
+        return self._help_cache[1], key
+
     # =====================
     # Help-printing methods
     # =====================
@@ -2358,6 +4044,13 @@ class ArgumentParser(_AttributeHolder, _ActionsContainer):
             self._print_message(message, _sys.stderr)
         _sys.exit(status)
 
+    def _report_error(self, error):
+        # exit with a usage message, unless the caller, or a parser that
+        # invoked this one as a subparser, handles the errors
+        if not self.exit_on_error or _raise_errors.get():
+            raise error
+        self.error(str(error))
+
     def error(self, message):
         """error(message: string)
 
@@ -1,13 +1,22 @@
 # Author: Steven J. Bethard <steven.bethard@gmail.com>.
 
+import asyncio
 import codecs
+import collections.abc
+import concurrent.futures
+import copy
+import dataclasses
+import enum
 import inspect
 import os
+import pickle
 import shutil
 import stat
 import sys
 import textwrap
 import tempfile
+import threading
+import typing
 import unittest
 import argparse
 
@@ -751,6 +760,78 @@ class TestOptionalsActionAppendConstWithDefault(ParserTestCase):
     ]
 
 
+class TestOptionalsActionExtend(ParserTestCase):
+    """Tests the extend action for an Optional"""
+
+    argument_signatures = [Sig('--baz', action='extend', nargs='+',
+                               default=['X'])]
+    failures = ['a', '--baz', 'a --baz']
+    successes = [
+        ('', NS(baz=['X'])),
+        ('--baz a', NS(baz=['X', 'a'])),
+        ('--baz a b --baz c', NS(baz=['X', 'a', 'b', 'c'])),
+    ]
+
+
+class TestAppendOwnership(TestCase):
+    """Test that append actions copy the current list only once"""
+
+    def test_default_not_modified(self):
+        default = ['X']
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--baz', action='append', default=default)
+        parser.add_argument('--const', dest='baz', action='append_const',
+                            const='C')
+        args = parser.parse_args('--baz a --const --baz b'.split())
+        self.assertEqual(args.baz, ['X', 'a', 'C', 'b'])
+        self.assertEqual(default, ['X'])
+        self.assertEqual(parser.parse_args(['--baz', 'c']), NS(baz=['X', 'c']))
+
+    def test_namespace_list_not_modified(self):
+        items = ['X']
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--baz', action='append')
+        args = parser.parse_args('--baz a --baz b'.split(),
+                                 argparse.Namespace(baz=items))
+        self.assertEqual(args.baz, ['X', 'a', 'b'])
+        self.assertEqual(items, ['X'])
+
+    def test_list_copied_once(self):
+        class CountingList(list):
+            copies = 0
+            def __copy__(self):
+                CountingList.copies += 1
+                return CountingList(self)
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('-I', action='append', default=CountingList())
+        args = parser.parse_args(['-Ia'] * 100)
+        self.assertEqual(args.I, ['a'] * 100)
+        self.assertEqual(CountingList.copies, 1)
+
+    def test_replaced_list_copied(self):
+        class ReplaceAction(argparse.Action):
+            def __call__(self, parser, namespace, values, option_string=None):
+                setattr(namespace, self.dest, self.const)
+        replacement = ['R']
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--baz', action='append')
+        parser.add_argument('--reset', dest='baz', action=ReplaceAction,
+                            nargs=0, const=replacement)
+        args = parser.parse_args('--baz a --reset --baz b'.split())
+        self.assertEqual(args.baz, ['R', 'b'])
+        self.assertEqual(replacement, ['R'])
+
+    def test_called_outside_parse(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('--baz', action='append')
+        namespace = argparse.Namespace(baz=None)
+        action(parser, namespace, 'a')
+        first = namespace.baz
+        action(parser, namespace, 'b')
+        self.assertEqual(first, ['a'])
+        self.assertEqual(namespace.baz, ['a', 'b'])
+
+
 class TestOptionalsActionCount(ParserTestCase):
     """Tests the count action for an Optional"""
 
@@ -1139,6 +1220,147 @@ class TestPositionalsChoicesInt(ParserTestCase):
     ]
 
 
+class TestPositionalsChoicesList(ParserTestCase):
+    """Test a long list of choices"""
+
+    argument_signatures = [
+        Sig('spam', nargs='+', type=int, choices=list(range(1000))),
+    ]
+    failures = ['', '--foo', 'h', '1000', '1 -1']
+    successes = [
+        ('4', NS(spam=[4])),
+        ('999 0 999', NS(spam=[999, 0, 999])),
+    ]
+
+
+class TestChoicesIndex(TestCase):
+    """Test the index of list and tuple choices"""
+
+    class CountingList(list):
+
+        def __init__(self, *args):
+            super(TestChoicesIndex.CountingList, self).__init__(*args)
+            self.lookups = 0
+
+        def __contains__(self, value):
+            self.lookups += 1
+            return super(TestChoicesIndex.CountingList, self).__contains__(value)
+
+    class OddTuple(tuple):
+
+        def __contains__(self, value):
+            return value in ('a', 'c')
+
+    def test_index_used(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('spam', nargs='+',
+                                     choices=('a', 'b', 'c'))
+        self.assertEqual(action._choices_index[1], frozenset('abc'))
+        self.assertEqual(parser.parse_args('a c b a'.split()),
+                         NS(spam=['a', 'c', 'b', 'a']))
+        self.assertRaises(ArgumentParserError, parser.parse_args, ['d'])
+
+    def test_lists_not_indexed(self):
+        choices = ['a', 'b', 'c']
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('spam', choices=choices)
+        self.assertIsNone(action._choices_index[1])
+        choices[0] = 'z'
+        self.assertRaises(ArgumentParserError, parser.parse_args, ['a'])
+        self.assertEqual(parser.parse_args(['z']), NS(spam='z'))
+        choices.append('d')
+        self.assertEqual(parser.parse_args(['d']), NS(spam='d'))
+
+    def test_own_contains_used(self):
+        choices = self.CountingList(['a', 'b', 'c'])
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('spam', nargs='+', choices=choices)
+        parser.parse_args('a c b'.split())
+        self.assertEqual(choices.lookups, 3)
+
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('spam', choices=self.OddTuple('abc'))
+        self.assertEqual(parser.parse_args(['c']), NS(spam='c'))
+        self.assertRaises(ArgumentParserError, parser.parse_args, ['b'])
+
+    def test_choices_replaced(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('spam', choices=('a', 'b'))
+        self.assertEqual(parser.parse_args(['a']), NS(spam='a'))
+        action.choices = ('x', 'y')
+        self.assertEqual(parser.parse_args(['x']), NS(spam='x'))
+        self.assertRaises(ArgumentParserError, parser.parse_args, ['a'])
+        action.choices = ['b']
+        self.assertEqual(parser.parse_args(['b']), NS(spam='b'))
+        self.assertRaises(ArgumentParserError, parser.parse_args, ['x'])
+
+    def test_unhashable_choices(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('spam', type=list, choices=[['a'], ['b']])
+        self.assertEqual(parser.parse_args(['b']), NS(spam=['b']))
+        self.assertRaises(ArgumentParserError, parser.parse_args, ['c'])
+
+    def test_unhashable_value(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('spam', type=list, choices=('a', ['b']))
+        self.assertEqual(parser.parse_args(['b']), NS(spam=['b']))
+
+    def test_order_kept_in_messages(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('spam', choices=['c', 'a', 'b'])
+        with self.assertRaises(ArgumentParserError) as cm:
+            parser.parse_args(['d'])
+        self.assertIn("(choose from 'c', 'a', 'b')", cm.exception.stderr)
+
+
+class TestChoicesFormatting(TestCase):
+    """Test that error messages do not list every choice"""
+
+    class Choices(collections.abc.Sequence):
+
+        def __init__(self, size):
+            self.size = size
+            self.lookups = 0
+
+        def __len__(self):
+            return self.size
+
+        def __getitem__(self, index):
+            if not 0 <= index < self.size:
+                raise IndexError(index)
+            self.lookups += 1
+            return 'c%d' % index
+
+        def __contains__(self, value):
+            return False
+
+        def __iter__(self):
+            raise AssertionError('choices should not be iterated')
+
+    def test_invalid_choice(self):
+        choices = self.Choices(100000)
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        parser.add_argument('spam', choices=choices)
+        with self.assertRaises(ArgumentParserError) as cm:
+            parser.parse_args(['x'])
+        self.assertIn("invalid choice: 'x' (choose from 'c0', 'c1', 'c2', "
+                      "'c3', 'c4', 'c5', 'c6', 'c7', 'c8', 'c9', "
+                      "... (99987 more), 'c99997', 'c99998', 'c99999')",
+                      cm.exception.stderr)
+        self.assertIn('{c0,c1,c2,c3,c4,c5,c6,c7,c8,c9,...,c99997,c99998,c99999}',
+                      cm.exception.stderr)
+        self.assertLess(choices.lookups, 100)
+
+    def test_subparser_choices(self):
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        subparsers = parser.add_subparsers()
+        for i in range(20):
+            subparsers.add_parser('cmd%d' % i)
+        with self.assertRaises(ArgumentParserError) as cm:
+            parser.parse_args(['x'])
+        self.assertIn("'cmd8', 'cmd9', ... (10 more))", cm.exception.stderr)
+
+
 class TestPositionalsActionAppend(ParserTestCase):
     """Test the 'append' action"""
 
@@ -1667,6 +1889,221 @@ class TestTypeRegistration(TestCase):
                          NS(x='my_type{1}', y='my_type{42}'))
 
 
+class Color(enum.Enum):
+    RED = 'r'
+    GREEN = 'g'
+    CRIMSON = 'r'
+
+
+class TestTypeEnum(ParserTestCase):
+    """Test an enum.Enum subclass as option/argument type"""
+
+    argument_signatures = [
+        Sig('-c', type=Color),
+        Sig('spam', type=Color),
+    ]
+    failures = ['BLUE', 'red', '-c', '-c BLUE RED']
+    successes = [
+        ('RED', NS(c=None, spam=Color.RED)),
+        ('-c GREEN CRIMSON', NS(c=Color.GREEN, spam=Color.RED)),
+        ('g -c r', NS(c=Color.RED, spam=Color.GREEN)),
+    ]
+
+
+class TestTypeMapping(ParserTestCase):
+    """Test a mapping as option/argument type"""
+
+    argument_signatures = [
+        Sig('-l', type={'debug': 10, 'info': 20}),
+        Sig('spam', type=argparse.LookupType({'debug': 10, 'Info': 20},
+                                              ignore_case=True)),
+    ]
+    failures = ['warn', '-l DEBUG debug', '-l 10 debug']
+    successes = [
+        ('DEBUG', NS(l=None, spam=10)),
+        ('-l info info', NS(l=20, spam=20)),
+    ]
+
+
+class TestLookupType(TestCase):
+
+    def test_error_message(self):
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        parser.add_argument('color', type=Color)
+        with self.assertRaises(ArgumentParserError) as cm:
+            parser.parse_args(['BLUE'])
+        self.assertIn("argument color: invalid choice: 'BLUE' "
+                      "(choose from 'RED', 'GREEN', 'CRIMSON')",
+                      cm.exception.stderr)
+
+    def test_type_is_replaced(self):
+        parser = argparse.ArgumentParser()
+        action = parser.add_argument('--color', type=Color)
+        self.assertIsInstance(action.type, argparse.LookupType)
+        self.assertEqual(repr(action.type), 'LookupType(%r)' % Color)
+
+    def test_ignore_case_enum(self):
+        lookup = argparse.LookupType(Color, ignore_case=True)
+        self.assertEqual(lookup('Green'), Color.GREEN)
+        self.assertEqual(lookup('crimson'), Color.RED)
+        self.assertEqual(repr(lookup),
+                         'LookupType(%r, ignore_case=True)' % Color)
+
+
+class TestTypeJSON(TempDirMixin, ParserTestCase):
+    """Test the JSONType option/argument type"""
+
+    def setUp(self):
+        super(TestTypeJSON, self).setUp()
+        for file_name, text in [('spec', '{"a": [1, 2]}'), ('bad', '{'),
+                                ('big', '[%s]' % ', '.join(['0'] * 100))]:
+            with open(os.path.join(self.temp_dir, file_name), 'w') as file:
+                file.write(text)
+
+    argument_signatures = [
+        Sig('-x', type=argparse.JSONType(max_size=100)),
+        Sig('spam', type=argparse.JSONType(prefix_chars='@+')),
+    ]
+    failures = ['{', '@bad', '@missing', '-x @big 1', '-x ' + '1' * 101]
+    successes = [
+        ('@spec', NS(x=None, spam={'a': [1, 2]})),
+        ('+spec -x 12', NS(x=12, spam={'a': [1, 2]})),
+        ('-x @spec [null]', NS(x={'a': [1, 2]}, spam=[None])),
+        ('@big', NS(x=None, spam=[0] * 100)),
+    ]
+
+
+class TestJSONType(TempDirMixin, TestCase):
+
+    def test_error_messages(self):
+        with open('big', 'w') as file:
+            file.write('[%s]' % ', '.join(['0'] * 100))
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('-x', type=argparse.JSONType(max_size=10))
+        with self.assertRaises(ArgumentParserError) as cm:
+            parser.parse_args(['-x', '@big'])
+        self.assertIn('argument -x: big is larger than 10 bytes',
+                      cm.exception.stderr)
+        with self.assertRaises(ArgumentParserError) as cm:
+            parser.parse_args(['-x', '"%s"' % ('x' * 10)])
+        self.assertIn('argument -x: JSON document is longer than 10 '
+                      'characters', cm.exception.stderr)
+        with self.assertRaises(ArgumentParserError) as cm:
+            parser.parse_args(['-x', '{'])
+        self.assertIn('argument -x: invalid JSON: ', cm.exception.stderr)
+
+    def test_repr(self):
+        self.assertEqual(repr(argparse.JSONType()), 'JSONType()')
+        self.assertEqual(repr(argparse.JSONType(10, '+')),
+                         "JSONType(max_size=10, prefix_chars='+')")
+
+
+class TestTypeTryConvert(TestCase):
+    """Test types converting through a try_convert() method"""
+
+    class Hex(object):
+
+        def __call__(self, string):
+            raise AssertionError('__call__ should not be used')
+
+        def try_convert(self, string):
+            if string == 'unknown':
+                return False, None
+            if string == 'raise':
+                raise ValueError(string)
+            try:
+                return True, int(string, 16)
+            except ValueError:
+                return False, 'not hexadecimal: %r' % string
+
+    def test_conversion(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('x', nargs='+', type=self.Hex())
+        self.assertEqual(parser.parse_args('a 1f'.split()), NS(x=[10, 31]))
+
+    def test_failures(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('x', type=self.Hex())
+        for arg, message in [('z', "argument x: not hexadecimal: 'z'"),
+                             ('unknown', "argument x: invalid .*Hex object.* "
+                                         "value: 'unknown'"),
+                             ('raise', "argument x: invalid .*Hex object.* "
+                                       "value: 'raise'")]:
+            with self.assertRaises(ArgumentParserError) as cm:
+                parser.parse_args([arg])
+            self.assertRegex(cm.exception.stderr, message)
+
+    def test_lookup_type(self):
+        lookup = argparse.LookupType({'a': 1})
+        self.assertEqual(lookup.try_convert('a'), (True, 1))
+        self.assertEqual(lookup.try_convert('b'),
+                         (False, "invalid choice: 'b' (choose from 'a')"))
+
+
+class TestTypeConversionCache(TestCase):
+    """Test memoised conversions with cache=True"""
+
+    def setUp(self):
+        super(TestTypeConversionCache, self).setUp()
+        self.calls = []
+
+    def region(self, string):
+        self.calls.append(string)
+        if string == 'bad':
+            raise ValueError(string)
+        return string.upper()
+
+    def test_repeated_values_converted_once(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('-r', action='append', type=self.region,
+                                     cache=True)
+        args = parser.parse_args('-r a -r b -r a -r a'.split())
+        self.assertEqual(args.r, ['A', 'B', 'A', 'A'])
+        self.assertEqual(self.calls, ['a', 'b'])
+        info = action.conversion_cache.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 2))
+
+    def test_cache_persists_across_parses(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('region', type=self.region, cache=True)
+        self.assertEqual(parser.parse_args(['a']), NS(region='A'))
+        self.assertEqual(parser.parse_args(['a']), NS(region='A'))
+        self.assertEqual(self.calls, ['a'])
+
+    def test_bounded_cache(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('-r', action='append', type=self.region,
+                                     cache=2)
+        parser.parse_args('-r a -r b -r c -r a'.split())
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'a'])
+        self.assertEqual(action.conversion_cache.cache_info().currsize, 2)
+
+    def test_failures_are_not_cached(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('-r', type=self.region, cache=True)
+        self.assertRaises(ArgumentParserError, parser.parse_args, ['-r', 'bad'])
+        self.assertRaises(ArgumentParserError, parser.parse_args, ['-r', 'bad'])
+        self.assertEqual(self.calls, ['bad', 'bad'])
+
+    def test_registered_type(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.register('type', 'region', self.region)
+        parser.add_argument('-r', nargs='+', type='region', cache=True)
+        args = parser.parse_args('-r a a a'.split())
+        self.assertEqual(args.r, ['A', 'A', 'A'])
+        self.assertEqual(self.calls, ['a'])
+
+    def test_no_cache_by_default(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('-r', type=self.region)
+        self.assertIsNone(action.conversion_cache)
+
+    def test_invalid_cache_size(self):
+        parser = argparse.ArgumentParser()
+        self.assertRaises(ValueError, parser.add_argument, '-r', cache=-1)
+        self.assertRaises(ValueError, parser.add_argument, '-r', cache='big')
+
+
 # ============
 # Action tests
 # ============
@@ -3553,6 +3990,89 @@ class TestHelpUsagePositionalsOnlyWrap(HelpTestCase):
     version = ''
 
 
+class TestHelpUsageBracketMetavars(TestCase):
+    """Test usage messages with brackets and parentheses in metavars"""
+
+    def test_metavars(self):
+        parser = argparse.ArgumentParser(prog='PROG')
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--foo', metavar='(X)')
+        parser.add_argument('--bar', metavar='[a b]')
+        parser.add_argument('--baz', metavar='x]y', nargs=2)
+        parser.add_argument('spam', metavar='[SPAM]')
+        self.assertEqual(parser.format_usage(),
+                         'usage: PROG [-h] --foo (X) [--bar [a b]] '
+                         '[--baz x]y x]y] [SPAM]\n')
+
+    def test_metavars_wrap(self):
+        parser = argparse.ArgumentParser(prog='PROG')
+        parser.add_argument('--bar', metavar='[a b]')
+        parser.add_argument('--long-option-name-' + 'x' * 20,
+                            metavar='[( Y )]')
+        parser.add_argument('spam', metavar='[SPAM]')
+        self.assertEqual(parser.format_usage(), '''\
+usage: PROG [-h] [--bar [a b]]
+            [--long-option-name-xxxxxxxxxxxxxxxxxxxx [( Y )]]
+            [SPAM]
+''')
+
+    def test_groups(self):
+        parser = argparse.ArgumentParser(prog='PROG', add_help=False)
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('-a', action='store_true')
+        group.add_argument('-b', help=argparse.SUPPRESS)
+        group.add_argument('-c', metavar='[C]')
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('-d', action='store_true', help=argparse.SUPPRESS)
+        group.add_argument('-e', action='store_true')
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('-f', action='store_true', help=argparse.SUPPRESS)
+        self.assertEqual(parser.format_usage(),
+                         'usage: PROG [-a | -c [C]] -e\n')
+
+
+class TestHelpUsageWrapParts(TestCase):
+    """Test that usage wraps between arguments, not inside them"""
+
+    def get_usage(self, width, arguments):
+        def formatter_class(prog):
+            return argparse.HelpFormatter(prog, width=width)
+        parser = argparse.ArgumentParser(prog='PROG', add_help=False,
+                                         formatter_class=formatter_class)
+        for args, kwargs in arguments:
+            parser.add_argument(*args, **kwargs)
+        return parser.format_usage()
+
+    def test_required_optional(self):
+        arguments = [(['-a'], dict(metavar='A' * 10)),
+                     (['-f'], dict(required=True, metavar='META')),
+                     (['-b'], dict(metavar='B' * 10))]
+        self.assertEqual(self.get_usage(33, arguments), '''\
+usage: PROG [-a AAAAAAAAAA]
+            -f META
+            [-b BBBBBBBBBB]
+''')
+
+    def test_positionals(self):
+        arguments = [(['-a'], dict(metavar='A' * 10)),
+                     (['files'], dict(nargs='+', metavar='FILE')),
+                     (['rest'], dict(nargs=2, metavar='R'))]
+        self.assertEqual(self.get_usage(30, arguments), '''\
+usage: PROG [-a AAAAAAAAAA]
+            FILE [FILE ...]
+            R R
+''')
+
+    def test_parts_wider_than_lines(self):
+        arguments = [(['-a'], dict(metavar='A' * 10)),
+                     (['files'], dict(nargs='+', metavar='FILE'))]
+        self.assertEqual(self.get_usage(20, arguments), '''\
+usage: PROG
+            [-a AAAAAAAAAA]
+            FILE [FILE ...]
+''')
+
+
 class TestHelpVariableExpansion(HelpTestCase):
     """Test that variables are expanded properly in help messages"""
 
@@ -3599,6 +4119,42 @@ class TestHelpVariableExpansion(HelpTestCase):
     version = ''
 
 
+class TestHelpLargeChoices(HelpTestCase):
+    """Test that large sets of choices are abbreviated"""
+
+    parser_signature = Sig(prog='PROG')
+    argument_signatures = [
+        Sig('-x', type=int, choices=range(1000000),
+            help='x %(choices)s'),
+        Sig('-y', type=int, choices=range(0, 100, 2),
+            help='y %(choices)s'),
+        Sig('-z', type=int, choices=dict.fromkeys(range(20)),
+            help='z %(choices)s'),
+        Sig('w', choices=['w%d' % i for i in range(14)]),
+    ]
+    argument_group_signatures = []
+    usage = ('''\
+        usage: PROG [-h] [-x {0..999999}] [-y {0,2,4,6,8,10,12,14,16,18,...,94,96,98}]
+                    [-z {0,1,2,3,4,5,6,7,8,9,...}]
+                    {w0,w1,w2,w3,w4,w5,w6,w7,w8,w9,...,w11,w12,w13}
+        ''')
+    help = usage + '''\
+
+        positional arguments:
+          {w0,w1,w2,w3,w4,w5,w6,w7,w8,w9,...,w11,w12,w13}
+
+        optional arguments:
+          -h, --help            show this help message and exit
+          -x {0..999999}        x 0..999999
+          -y {0,2,4,6,8,10,12,14,16,18,...,94,96,98}
+                                y 0, 2, 4, 6, 8, 10, 12, 14, 16, 18, ... (37 more),
+                                94, 96, 98
+          -z {0,1,2,3,4,5,6,7,8,9,...}
+                                z 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, ... (10 more)
+        '''
+    version = ''
+
+
 class TestHelpVariableExpansionUsageSupplied(HelpTestCase):
     """Test that variables are expanded properly when usage= is present"""
 
@@ -4118,6 +4674,304 @@ class TestHelpMetavarTypeFormatter(HelpTestCase):
     version = ''
 
 
+class TestHelpFormattedOnce(TestCase):
+    """Test that each part of the help is formatted once"""
+
+    def test_groups(self):
+        calls = []
+
+        class Formatter(argparse.HelpFormatter):
+            def _format_action(self, action):
+                calls.append(action.dest)
+                return super(Formatter, self)._format_action(action)
+
+        parser = argparse.ArgumentParser(prog='PROG',
+                                         formatter_class=Formatter)
+        for i in range(50):
+            group = parser.add_argument_group('group %d' % i)
+            for j in range(10):
+                group.add_argument('--option-%d-%d' % (i, j), help='HELP')
+        help = parser.format_help()
+        self.assertEqual(len(calls), 501)
+        self.assertEqual(len(set(calls)), 501)
+        self.assertIn('\ngroup 49:\n  --option-49-0 OPTION_49_0', help)
+
+
+class TestHelpCache(TestCase):
+    """Test that formatted help is reused until the parser changes"""
+
+    def setUp(self):
+        self.calls = calls = []
+
+        class Formatter(argparse.HelpFormatter):
+            def format_help(self):
+                calls.append(self)
+                return super(Formatter, self).format_help()
+
+        self.parser = argparse.ArgumentParser(prog='PROG',
+                                              formatter_class=Formatter)
+        self.action = self.parser.add_argument('--foo', help='FOO')
+
+    def assertReformatted(self, reformatted=True):
+        parser = self.parser
+        del self.calls[:]
+        help = parser.format_help()
+        usage = parser.format_usage()
+        self.assertEqual(len(self.calls), 2 if reformatted else 0)
+        self.assertEqual(parser.format_help(), help)
+        self.assertEqual(parser.format_usage(), usage)
+        self.assertEqual(len(self.calls), 2 if reformatted else 0)
+        return help
+
+    def test_cached(self):
+        self.assertReformatted()
+        self.assertReformatted(False)
+        with support.captured_stderr() as stderr:
+            self.assertRaises(SystemExit, self.parser.error, 'message')
+        self.assertEqual(self.calls, [])
+        self.assertTrue(stderr.getvalue().startswith('usage: PROG'))
+
+    def test_add_argument(self):
+        self.assertReformatted()
+        self.parser.add_argument('--bar')
+        self.assertIn('--bar', self.assertReformatted())
+
+    def test_argument_group(self):
+        self.assertReformatted()
+        self.parser.add_argument_group('title', 'description')
+        self.assertIn('title:\n  description', self.assertReformatted())
+
+    def test_set_defaults(self):
+        self.action.help = 'FOO (default: %(default)s)'
+        self.assertIn('(default: None)', self.assertReformatted())
+        self.parser.set_defaults(foo='spam')
+        self.assertIn('(default: spam)', self.assertReformatted())
+
+    def test_action_changed(self):
+        self.assertReformatted()
+        self.action.help = 'NEW'
+        self.assertIn('NEW', self.assertReformatted())
+
+    def test_parser_attributes(self):
+        self.assertReformatted()
+        self.parser.prog = 'OTHER'
+        self.assertIn('usage: OTHER', self.assertReformatted())
+        self.parser.epilog = 'EPILOG'
+        self.assertIn('EPILOG', self.assertReformatted())
+
+    def test_width(self):
+        self.assertReformatted()
+        with support.EnvironmentVarGuard() as env:
+            env['COLUMNS'] = '40'
+            self.assertReformatted()
+        self.assertReformatted(False)
+
+    def test_add_parser(self):
+        subparsers = self.parser.add_subparsers()
+        subparsers.add_parser('a', help='A')
+        self.assertReformatted()
+        subparsers.add_parser('b', help='B')
+        self.assertIn('{a,b}', self.assertReformatted())
+
+
+class TestHelpSnapshot(TestCase):
+    """Test serving help from snapshots written ahead of time"""
+
+    def get_parser(self):
+        parser = argparse.ArgumentParser(prog='PROG', description='DESC')
+        parser.add_argument('--foo', type=int, default=1,
+                            help='foo help %(default)s ' * 5)
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('-a', action='store_true')
+        group.add_argument('-b', action='store_true')
+        subparsers = parser.add_subparsers(dest='command')
+        subparser = subparsers.add_parser('run', help='run things')
+        subparser.add_argument('jobs', type=int, help='number of jobs')
+        return parser
+
+    def get_snapshot(self, **kwargs):
+        file = StringIO()
+        self.get_parser().write_help_snapshot(file, **kwargs)
+        file.seek(0)
+        return file
+
+    def load(self, snapshot):
+        parser = self.get_parser()
+        parser.load_help_snapshot(snapshot)
+        snapshot.seek(0)
+        subparser = parser._subparsers._group_actions[0].choices['run']
+        return parser, subparser
+
+    def test_served(self):
+        snapshot = self.get_snapshot()
+        parser, subparser = self.load(snapshot)
+        live_parser = self.get_parser()
+        live_subparser = live_parser._subparsers._group_actions[0].choices
+        live_subparser = live_subparser['run']
+        with support.EnvironmentVarGuard() as env:
+            for columns in ['80', '100', '130']:
+                env['COLUMNS'] = columns
+                self.assertEqual(parser.format_help(),
+                                 live_parser.format_help())
+                self.assertEqual(parser.format_usage(),
+                                 live_parser.format_usage())
+                self.assertEqual(subparser.format_help(),
+                                 live_subparser.format_help())
+
+    def test_not_formatted(self):
+        parser, subparser = self.load(self.get_snapshot())
+
+        def fail(formatter):
+            raise AssertionError('help should not be formatted')
+
+        parser._format_help = subparser._format_help = fail
+        with support.EnvironmentVarGuard() as env:
+            env['COLUMNS'] = '100'
+            self.assertIn('foo help 1', parser.format_help())
+            self.assertIn('number of jobs', subparser.format_help())
+
+    def test_width_buckets(self):
+        snapshot = self.get_snapshot(columns=[80, 120])
+        parser, subparser = self.load(snapshot)
+        with support.EnvironmentVarGuard() as env:
+            env['COLUMNS'] = '100'
+            help = parser.format_help()
+            env['COLUMNS'] = '80'
+            self.assertEqual(help, self.get_parser().format_help())
+            env['COLUMNS'] = '60'
+            self.assertEqual(parser.format_help(),
+                             self.get_parser().format_help())
+
+    def test_changed_parser(self):
+        parser, subparser = self.load(self.get_snapshot())
+        parser.add_argument('--bar')
+        self.assertIn('--bar', parser.format_help())
+        subparser.description = 'changed'
+        self.assertIn('changed', subparser.format_help())
+
+    def test_invalid_snapshot(self):
+        parser = self.get_parser()
+        self.assertRaises(ValueError, parser.load_help_snapshot,
+                          StringIO('{"version": 2}'))
+
+    def test_formatter_factory(self):
+        def formatter_class(prog):
+            return argparse.HelpFormatter(prog, max_help_position=40)
+        parser = self.get_parser()
+        parser.formatter_class = formatter_class
+        file = StringIO()
+        parser.write_help_snapshot(file)
+        file.seek(0)
+        parser.load_help_snapshot(file)
+        subparser = parser._subparsers._group_actions[0].choices['run']
+        self.assertIsNone(parser._get_help_snapshot(
+            parser._get_formatter(), 'help'))
+        self.assertIsNotNone(subparser._get_help_snapshot(
+            subparser._get_formatter(), 'help'))
+        live_parser = self.get_parser()
+        live_parser.formatter_class = formatter_class
+        self.assertEqual(parser.format_help(), live_parser.format_help())
+
+
+class TestHelpInvocationCache(TestCase):
+    """Test that invocation strings are formatted once per action"""
+
+    def setUp(self):
+        self.calls = calls = []
+
+        class Formatter(argparse.HelpFormatter):
+            def _get_action_invocation(self, action):
+                calls.append(action)
+                sup = super(Formatter, self)
+                return sup._get_action_invocation(action)
+
+        self.parser = argparse.ArgumentParser(prog='PROG',
+                                              formatter_class=Formatter)
+        self.subparsers = self.parser.add_subparsers(dest='command')
+        for i in range(5):
+            self.subparsers.add_parser('cmd%d' % i, help='help %d' % i)
+
+    def test_formatted_once(self):
+        help = self.parser.format_help()
+        self.assertEqual(len(self.calls), len(set(self.calls)))
+        self.assertEqual(len(self.calls), 7)
+        del self.calls[:]
+        formatter = self.parser._get_formatter()
+        self.assertEqual(self.parser._format_help(formatter), help)
+        self.assertEqual(self.calls, [])
+
+    def test_action_changed(self):
+        self.parser.format_help()
+        self.subparsers.metavar = 'COMMAND'
+        self.assertIn('  COMMAND\n', self.parser.format_help())
+        self.assertEqual(self.calls.count(self.subparsers), 2)
+
+    def test_parser_added(self):
+        self.parser.format_help()
+        self.subparsers.add_parser('extra')
+        self.assertIn('{cmd0,cmd1,cmd2,cmd3,cmd4,extra}',
+                      self.parser.format_help())
+
+    def test_formatter_classes(self):
+        parser = argparse.ArgumentParser(prog='PROG')
+        parser.add_argument('--foo', type=int)
+        self.assertIn('--foo FOO', parser.format_help())
+        parser.formatter_class = argparse.MetavarTypeHelpFormatter
+        self.assertIn('--foo int', parser.format_help())
+
+
+class TestHelpWrapping(TestCase):
+    """Test that help text is wrapped like textwrap wraps it"""
+
+    texts = [
+        '',
+        'word',
+        'a few short words that fill several lines of help',
+        'an extraordinarily-hyphenated, self-describing phrase',
+        'a veryveryveryverylongwordthatneedsbreaking in the text',
+        'caf\xe9 na\xefve r\xe9sum\xe9 text with accented letters',
+        'the -x and --long options -- and an em-dash',
+    ]
+
+    def test_split_lines(self):
+        formatter = argparse.HelpFormatter(prog='PROG')
+        for text in self.texts:
+            for width in range(1, 30):
+                self.assertEqual(formatter._split_lines(text, width),
+                                 textwrap.wrap(text, width))
+
+    def test_fill_text(self):
+        formatter = argparse.HelpFormatter(prog='PROG')
+        for text in self.texts:
+            for width in range(1, 30):
+                for indent in ['', '    ']:
+                    expected = textwrap.fill(text, width,
+                                             initial_indent=indent,
+                                             subsequent_indent=indent)
+                    self.assertEqual(formatter._fill_text(text, width,
+                                                          indent),
+                                     expected)
+
+    def test_whitespace(self):
+        formatter = argparse.HelpFormatter(prog='PROG')
+        self.assertEqual(formatter._split_lines('  a\tb \n\n c  ', 3),
+                         ['a b', 'c'])
+
+    def test_invalid_width(self):
+        formatter = argparse.HelpFormatter(prog='PROG')
+        self.assertRaises(ValueError, formatter._split_lines, 'text', 0)
+
+    def test_lines_reused(self):
+        formatter = argparse.HelpFormatter(prog='PROG')
+        text = 'lines that are wrapped once and then reused'
+        lines = formatter._split_lines(text, 10)
+        lines.append('changed')
+        info = argparse._wrap_text.cache_info()
+        self.assertEqual(formatter._split_lines(text, 10), lines[:-1])
+        self.assertEqual(argparse._wrap_text.cache_info().hits,
+                         info.hits + 1)
+
+
 # =====================================
 # Optional/Positional constructor tests
 # =====================================
@@ -4464,6 +5318,109 @@ class TestStrings(TestCase):
             "add_help=True)" % argparse.HelpFormatter)
         self.assertStringEqual(parser, string)
 
+class TestBoundedRepr(TestCase):
+    """Test that repr() shows a limited number of container items"""
+
+    def test_containers(self):
+        ns = argparse.Namespace(
+            l=list(range(150)), t=tuple(range(101)), s=set(range(200)),
+            f=frozenset(range(300)), d=dict.fromkeys(range(120)))
+        string = repr(ns)
+        self.assertIn('l=[0, 1, 2, ', string)
+        self.assertIn(', 99, ... (50 more)], ', string)
+        self.assertIn(', 99, ... (1 more)))', string)
+        self.assertIn('... (100 more)}, ', string)
+        self.assertIn('f=frozenset({0, 1, ', string)
+        self.assertIn('... (200 more)}), ', string)
+        self.assertIn('d={0: None, 1: None, ', string)
+        self.assertIn('99: None, ... (20 more)}', string)
+        self.assertLess(len(string), 3000)
+
+    def test_small_values(self):
+        values = [[], (), set(), frozenset(), {}, (1,), [1, (2,)],
+                  {'a': [1, {2}]}, frozenset([3]), 'x' * 200,
+                  argparse.Namespace(a=[1])]
+        for value in values:
+            ns = argparse.Namespace(value=value)
+            self.assertEqual(repr(ns), 'Namespace(value=%r)' % (value,))
+
+    def test_nested(self):
+        ns = argparse.Namespace(x=[list(range(200))] * 200)
+        self.assertEqual(repr(ns).count('... (100 more)'), 101)
+
+    def test_recursive(self):
+        items = [1]
+        items.append(items)
+        ns = argparse.Namespace(items=items)
+        ns.ns = ns
+        self.assertEqual(repr(ns), 'Namespace(items=[1, [...]], ns=...)')
+
+    def test_action(self):
+        action = argparse.Action(['-x'], dest='x', choices=list(range(1000)))
+        self.assertIn('choices=[0, 1, 2, ', repr(action))
+        self.assertIn('... (900 more)]', repr(action))
+
+    def test_parser_limit(self):
+        parser = ErrorRaisingArgumentParser(repr_limit=2)
+        parser.add_argument('x', nargs='*')
+        args = parser.parse_args('a b c d'.split())
+        self.assertIs(type(args), argparse.Namespace)
+        self.assertEqual(args, NS(x=['a', 'b', 'c', 'd']))
+        self.assertEqual(parser.format_namespace(args),
+                         "Namespace(x=['a', 'b', ... (2 more)])")
+        self.assertEqual(repr(args), "Namespace(x=['a', 'b', 'c', 'd'])")
+        vars(args)['y'] = 1
+        self.assertEqual(args.y, 1)
+
+    def test_parser_without_limit(self):
+        parser = ErrorRaisingArgumentParser(repr_limit=None)
+        parser.add_argument('x', nargs='*')
+        strings = [str(i) for i in range(500)]
+        args = parser.parse_args(strings)
+        self.assertEqual(parser.format_namespace(args),
+                         'Namespace(x=%r)' % (strings,))
+
+    def test_slots_namespace_limit(self):
+        parser = ErrorRaisingArgumentParser(namespace_class='slots',
+                                            repr_limit=0)
+        parser.add_argument('x', nargs='*')
+        args = parser.parse_args('a b'.split())
+        self.assertEqual(args.x, ['a', 'b'])
+        self.assertEqual(parser.format_namespace(args),
+                         'Namespace(x=[... (2 more)])')
+
+    def test_write_namespace(self):
+        ns = argparse.Namespace(l=list(range(1000)), s='spam')
+        pieces = []
+
+        class File(object):
+            def write(self, piece):
+                pieces.append(piece)
+
+        parser = ErrorRaisingArgumentParser()
+        parser.write_namespace(ns, File())
+        self.assertEqual(''.join(pieces), repr(ns))
+        self.assertLess(max(map(len, pieces)), 20)
+
+        file = StringIO()
+        ErrorRaisingArgumentParser(repr_limit=2).write_namespace(ns, file)
+        self.assertEqual(file.getvalue(),
+                         "Namespace(l=[0, 1, ... (998 more)], s='spam')")
+        file = StringIO()
+        ErrorRaisingArgumentParser(repr_limit=None).write_namespace(ns, file)
+        self.assertEqual(file.getvalue(),
+                         'Namespace(l=%r, s=%r)' % (ns.l, ns.s))
+
+    def test_write_repr_dest(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--write-repr', action='store_true')
+        args = parser.parse_args([])
+        self.assertIs(args.write_repr, False)
+        self.assertEqual(repr(args), 'Namespace(write_repr=False)')
+        args = parser.parse_args(['--write-repr'])
+        self.assertIs(args.write_repr, True)
+
+
 # ===============
 # Namespace tests
 # ===============
@@ -4495,6 +5452,1032 @@ class TestNamespace(TestCase):
         self.assertTrue(ns2 != ns4)
 
 
+class TestSlotsNamespace(TestCase):
+    """Test namespace_class='slots'"""
+
+    def _get_parser(self):
+        parser = ErrorRaisingArgumentParser(namespace_class='slots')
+        parser.add_argument('--foo', type=int)
+        parser.add_argument('--bar-baz', action='append')
+        parser.add_argument('spam', nargs='?')
+        return parser
+
+    def test_parse_args(self):
+        args = self._get_parser().parse_args('--foo 1 --bar-baz x'.split())
+        self.assertIsInstance(args, argparse.Namespace)
+        self.assertEqual(NS(foo=1, bar_baz=['x'], spam=None), args)
+        self.assertEqual(args, argparse.Namespace(foo=1, bar_baz=['x'],
+                                                  spam=None))
+        self.assertEqual(repr(args),
+                         "Namespace(bar_baz=['x'], foo=1, spam=None)")
+        self.assertIn('foo', args)
+        self.assertNotIn('help', args)
+
+    def test_slots(self):
+        args = self._get_parser().parse_args([])
+        self.assertEqual(type(args).__slots__, ('help', 'foo', 'bar_baz', 'spam'))
+        self.assertEqual(argparse._instance_dict(args), {})
+
+    def test_class_reused(self):
+        parser = self._get_parser()
+        self.assertIs(type(parser.parse_args([])), type(parser.parse_args([])))
+
+    def test_class_regenerated(self):
+        parser = self._get_parser()
+        old_class = type(parser.parse_args([]))
+        parser.add_argument('--new')
+        group = parser.add_argument_group('group')
+        group.add_argument('--grouped')
+        parser.set_defaults(other=42)
+        args = parser.parse_args([])
+        self.assertIsNot(type(args), old_class)
+        self.assertEqual(type(args).__slots__,
+                         ('help', 'foo', 'bar_baz', 'spam', 'new', 'grouped',
+                          'other'))
+        self.assertEqual(args.other, 42)
+
+    def test_other_attributes(self):
+        parser = self._get_parser()
+        parser.set_defaults(**{'not-an-identifier': 1, '__private': 2})
+        args = parser.parse_args([])
+        args.extra = 3
+        self.assertEqual(argparse._instance_dict(args),
+                         {'not-an-identifier': 1, '__private': 2, 'extra': 3})
+        self.assertEqual(vars(args),
+                         {'foo': None, 'bar_baz': None, 'spam': None,
+                          'not-an-identifier': 1, '__private': 2, 'extra': 3})
+
+    def test_subparsers(self):
+        parser = self._get_parser()
+        subparsers = parser.add_subparsers(dest='command')
+        subparser = subparsers.add_parser('run')
+        subparser.add_argument('-x')
+        args = parser.parse_args('--foo 1 spam run -x X'.split())
+        self.assertEqual(NS(foo=1, bar_baz=None, spam='spam', command='run',
+                            x='X'), args)
+
+    def test_copy_and_pickle(self):
+        args = self._get_parser().parse_args('--bar-baz x'.split())
+        self.assertIs(type(copy.copy(args)), type(args))
+        self.assertEqual(copy.copy(args), args)
+        copied = copy.deepcopy(args)
+        self.assertEqual(copied, args)
+        self.assertIsNot(copied.bar_baz, args.bar_baz)
+        for proto in range(pickle.HIGHEST_PROTOCOL + 1):
+            unpickled = pickle.loads(pickle.dumps(args, proto))
+            self.assertIs(type(unpickled), argparse.Namespace)
+            self.assertEqual(unpickled, args)
+
+    def test_namespace_class(self):
+        class MyNamespace(argparse.Namespace):
+            pass
+        parser = ErrorRaisingArgumentParser(namespace_class=MyNamespace)
+        parser.add_argument('--foo')
+        self.assertIsInstance(parser.parse_args([]), MyNamespace)
+
+    def test_namespace_argument(self):
+        parser = self._get_parser()
+        args = parser.parse_args([], namespace=argparse.Namespace())
+        self.assertIs(type(args), argparse.Namespace)
+
+    def test_unknown_namespace_class(self):
+        self.assertRaises(ValueError, argparse.ArgumentParser,
+                          namespace_class='dict')
+
+
+@dataclasses.dataclass
+class Options:
+    foo: int
+    bar: list = None
+    verbose: bool = False
+
+
+class Point(typing.NamedTuple):
+    x: int
+    y: int = 0
+
+
+class TestParseArgsTarget(TestCase):
+    """Test parsing into dataclasses and named tuples with target="""
+
+    def _get_parser(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('foo', type=int)
+        parser.add_argument('--bar', action='append')
+        parser.add_argument('-v', dest='verbose', action='store_true')
+        return parser
+
+    def test_dataclass(self):
+        parser = self._get_parser()
+        options = parser.parse_args('1 --bar a -v --bar b'.split(),
+                                    target=Options)
+        self.assertEqual(options, Options(foo=1, bar=['a', 'b'], verbose=True))
+
+    def test_named_tuple(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('x', type=int)
+        parser.add_argument('-y', type=int, default=argparse.SUPPRESS)
+        self.assertEqual(parser.parse_args(['1'], target=Point), Point(1, 0))
+        self.assertEqual(parser.parse_args('1 -y 2'.split(), target=Point),
+                         Point(1, 2))
+
+    def test_collections_named_tuple(self):
+        Pair = collections.namedtuple('Pair', 'first second')
+        parser = argparse.ArgumentParser()
+        parser.add_argument('first')
+        parser.add_argument('second')
+        self.assertEqual(parser.parse_args('a b'.split(), target=Pair),
+                         Pair('a', 'b'))
+
+    def test_parse_known_args(self):
+        parser = self._get_parser()
+        options, extras = parser.parse_known_args('1 -x'.split(),
+                                                  target=Options)
+        self.assertEqual(options, Options(foo=1))
+        self.assertEqual(extras, ['-x'])
+
+    def test_set_defaults(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('x', type=int)
+        parser.set_defaults(y=3)
+        self.assertEqual(parser.parse_args(['1'], target=Point), Point(1, 3))
+
+    def test_unknown_destination(self):
+        parser = self._get_parser()
+        parser.add_argument('--baz')
+        with self.assertRaises(ValueError) as cm:
+            parser.parse_args(['1'], target=Options)
+        self.assertEqual(str(cm.exception),
+                         'no fields of Options for destinations: baz')
+
+    def test_missing_field(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', default=argparse.SUPPRESS)
+        with self.assertRaises(ValueError) as cm:
+            parser.parse_args([], target=Options)
+        self.assertEqual(str(cm.exception),
+                         'fields of Options that may not be set: foo')
+
+    def test_checked_again_after_changes(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('x', type=int)
+        parser.parse_args(['1'], target=Point)
+        parser.add_argument('-z')
+        self.assertRaises(ValueError, parser.parse_args, ['1'], target=Point)
+
+    def test_invalid_target(self):
+        parser = self._get_parser()
+        self.assertRaises(TypeError, parser.parse_args, ['1'], target=dict)
+        self.assertRaises(TypeError, parser.parse_args, ['1'], target=tuple)
+
+    def test_parse_args_async(self):
+        async def double(string):
+            return int(string) * 2
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('x', type=double)
+        point = asyncio.run(parser.parse_args_async(['2'], target=Point))
+        self.assertEqual(point, Point(4, 0))
+
+    def test_parse_args_async_provenance(self):
+        async def double(string):
+            return int(string) * 2
+        parser = argparse.ArgumentParser()
+        parser.add_argument('x', type=double)
+        parser.add_argument('-y', type=int, default=5)
+        provenance = argparse.Provenance()
+        point = asyncio.run(parser.parse_args_async(['2'], target=Point,
+                                                    provenance=provenance))
+        self.assertEqual(point, Point(4, 5))
+        self.assertEqual(provenance['x'], argparse.FROM_COMMAND_LINE)
+        self.assertEqual(provenance['y'], argparse.FROM_DEFAULT)
+
+    def test_subparser_destinations(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('x', type=int)
+        subparsers = parser.add_subparsers()
+        subparser = subparsers.add_parser('run')
+        subparser.add_argument('-y', type=int)
+        self.assertEqual(parser.parse_args('1 run -y 2'.split(),
+                                           target=Point), Point(1, 2))
+        subparser.add_argument('-z')
+        with self.assertRaises(ValueError) as cm:
+            parser.parse_args('1 run -z 2'.split(), target=Point)
+        self.assertEqual(str(cm.exception),
+                         'no fields of Point for destinations: z')
+
+    def test_suppressed_destination(self):
+        parser = ErrorRaisingArgumentParser(
+            argument_default=argparse.SUPPRESS)
+        parser.add_argument('--foo', type=int, default=0)
+        parser.add_argument('--baz')
+        with self.assertRaises(ValueError) as cm:
+            parser.parse_args([], target=Options)
+        self.assertEqual(str(cm.exception),
+                         'no fields of Options for destinations: baz')
+
+    def test_namespace_attributes(self):
+        parser = self._get_parser()
+        options = parser.parse_args(['1'], namespace=NS(bar=['a']),
+                                    target=Options)
+        self.assertEqual(options, Options(foo=1, bar=['a']))
+        with self.assertRaises(ValueError) as cm:
+            parser.parse_args(['1'], namespace=NS(extra=1), target=Options)
+        self.assertEqual(str(cm.exception),
+                         'no fields of Options for destinations: extra')
+
+    def test_values_stored_by_actions(self):
+        class StoreTwice(argparse.Action):
+            def __call__(self, parser, namespace, values, option_string=None):
+                setattr(namespace, self.dest, values)
+                setattr(namespace, 'other', values)
+        parser = argparse.ArgumentParser()
+        parser.add_argument('x', type=int, action=StoreTwice)
+        with self.assertRaises(ValueError) as cm:
+            parser.parse_args(['1'], target=Point)
+        self.assertEqual(str(cm.exception),
+                         'no fields of Point for destinations: other')
+
+    def test_values_collected_in_buffer(self):
+        class Check(argparse.Action):
+            def __call__(self, parser, namespace, values, option_string=None):
+                test.assertIs(type(namespace), argparse._RecordBuffer)
+                setattr(namespace, self.dest, values)
+        test = self
+        parser = argparse.ArgumentParser()
+        parser.add_argument('x', type=int, action=Check)
+        self.assertEqual(parser.parse_args(['1'], target=Point), Point(1, 0))
+
+
+class TestParseTemplate(TestCase):
+    """Test the defaults and checks cached between parses"""
+
+    def test_template_reused(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', default='x')
+        template = parser._get_parse_template()
+        parser.parse_args([])
+        self.assertIs(parser._get_parse_template(), template)
+
+    def test_template_invalidated(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('--foo', default='x')
+        self.assertEqual(parser.parse_args([]), NS(foo='x'))
+        parser.add_argument('--bar', default='y')
+        self.assertEqual(parser.parse_args([]), NS(foo='x', bar='y'))
+        parser.set_defaults(foo='z')
+        self.assertEqual(parser.parse_args([]), NS(foo='z', bar='y'))
+        action.default = 'w'
+        self.assertEqual(parser.parse_args([]), NS(foo='w', bar='y'))
+        group = parser.add_argument_group('group')
+        group.add_argument('--baz', default='v')
+        self.assertEqual(parser.parse_args([]), NS(foo='w', bar='y', baz='v'))
+        action.required = True
+        self.assertRaises(ArgumentParserError, parser.parse_args, [])
+
+    def test_actions_shared_with_children(self):
+        parent = ErrorRaisingArgumentParser(prog='PROG')
+        action = parent.add_argument('--foo')
+        child = ErrorRaisingArgumentParser(parents=[parent], add_help=False)
+        self.assertEqual(parent.parse_args([]), NS(foo=None))
+        self.assertEqual(child.parse_args([]), NS(foo=None))
+        self.assertNotIn('FOO help', parent.format_help())
+        action.default = '5'
+        action.help = 'FOO help'
+        self.assertEqual(parent.parse_args([]), NS(foo='5'))
+        self.assertEqual(child.parse_args([]), NS(foo='5'))
+        self.assertIn('FOO help', parent.format_help())
+        self.assertIn('FOO help', child.format_help())
+
+    def test_action_state_kept(self):
+        class RememberAction(argparse.Action):
+            def __call__(self, parser, namespace, values, option_string=None):
+                self.last_seen = values
+                setattr(namespace, self.dest, values)
+
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('--foo', action=RememberAction)
+        template = parser._get_parse_template()
+        help = parser.format_help()
+        revision = parser._revision[0]
+        self.assertEqual(parser.parse_args(['--foo', 'x']), NS(foo='x'))
+        self.assertEqual(action.last_seen, 'x')
+        self.assertEqual(parser._revision[0], revision)
+        self.assertIs(parser._get_parse_template(), template)
+        self.assertIs(parser.format_help(), help)
+        action.metavar = 'BAR'
+        self.assertIn('--foo BAR', parser.format_help())
+
+    def test_string_defaults_converted_once(self):
+        calls = []
+        def number(string):
+            calls.append(string)
+            return int(string)
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', type=number, default='1', cache=True)
+        parser.add_argument('--bar', type=int, default='2')
+        for _ in range(3):
+            self.assertEqual(parser.parse_args([]), NS(foo=1, bar=2))
+        self.assertEqual(parser.parse_args(['--foo', '3']), NS(foo=3, bar=2))
+        self.assertEqual(calls, ['1', '3'])
+
+    def test_other_string_defaults_converted_each_time(self):
+        calls = []
+        def number(string):
+            calls.append(string)
+            return int(string)
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', type=number, default='1')
+        parser.parse_args([])
+        parser.parse_args([])
+        self.assertEqual(calls, ['1', '1'])
+
+    def test_invalid_string_default(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', type=int, default='x')
+        self.assertRaises(ArgumentParserError, parser.parse_args, [])
+        self.assertEqual(parser.parse_args(['--foo', '1']), NS(foo=1))
+
+    def test_existing_namespace(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', type=int, default='1')
+        parser.add_argument('--bar', default='y')
+        namespace = argparse.Namespace(bar='z')
+        self.assertIs(parser.parse_args([], namespace), namespace)
+        self.assertEqual(namespace, argparse.Namespace(foo=1, bar='z'))
+
+    def test_empty_args(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', type=int, default='1')
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('--bar', action='store_true')
+        self.assertRaises(ArgumentParserError, parser.parse_args, [])
+        self.assertEqual(parser.parse_args(['--bar']), NS(foo=1, bar=True))
+        self.assertEqual(parser.parse_known_args(['--bar', 'x']),
+                         (NS(foo=1, bar=True), ['x']))
+
+
+class TestDefaultFactory(TestCase):
+    """Test default_factory= for defaults computed after parsing"""
+
+    def setUp(self):
+        super(TestDefaultFactory, self).setUp()
+        self.calls = 0
+
+    def factory(self):
+        self.calls += 1
+        return ['default']
+
+    def test_called_when_missing(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', default_factory=self.factory)
+        first = parser.parse_args([])
+        second = parser.parse_args([])
+        self.assertEqual(first, NS(foo=['default']))
+        self.assertIsNot(first.foo, second.foo)
+        self.assertEqual(self.calls, 2)
+
+    def test_not_called_when_given(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', action='append',
+                            default_factory=self.factory)
+        self.assertEqual(parser.parse_args('--foo a --foo b'.split()),
+                         NS(foo=['a', 'b']))
+        self.assertEqual(self.calls, 0)
+
+    def test_not_called_when_rejected(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', default_factory=self.factory)
+        parser.add_argument('bar')
+        self.assertRaises(ArgumentParserError, parser.parse_args, [])
+        self.assertEqual(self.calls, 0)
+
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', default_factory=self.factory)
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('-x', action='store_true')
+        group.add_argument('-y', action='store_true')
+        self.assertRaises(ArgumentParserError, parser.parse_args, [])
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(parser.parse_args(['-x']),
+                         NS(foo=['default'], x=True, y=False))
+        self.assertEqual(self.calls, 1)
+
+    def test_positionals(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('foo', nargs='?', default_factory=self.factory)
+        parser.add_argument('bar', nargs='*', choices=['b'], default_factory=dict)
+        self.assertEqual(parser.parse_args([]),
+                         NS(foo=['default'], bar={}))
+        self.assertEqual(parser.parse_args('a b'.split()),
+                         NS(foo='a', bar=['b']))
+        self.assertEqual(self.calls, 1)
+
+    def test_existing_namespace(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', default_factory=self.factory)
+        namespace = argparse.Namespace(foo='spam')
+        self.assertEqual(parser.parse_args([], namespace), NS(foo='spam'))
+        self.assertEqual(self.calls, 0)
+
+    def test_set_defaults(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--foo', default_factory=self.factory)
+        parser.set_defaults(foo='spam')
+        self.assertEqual(parser.parse_args([]), NS(foo='spam'))
+        self.assertEqual(self.calls, 0)
+
+    def test_attribute(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('--foo', default_factory=self.factory)
+        self.assertEqual(action.default_factory, self.factory)
+        self.assertIsNone(action.default)
+        action = parser.add_argument('--bar')
+        self.assertIsNone(action.default_factory)
+
+    def test_invalid(self):
+        parser = argparse.ArgumentParser()
+        self.assertRaises(ValueError, parser.add_argument, '--foo',
+                          default=1, default_factory=list)
+        self.assertRaises(ValueError, parser.add_argument, '--foo',
+                          default_factory=1)
+
+
+class TestActionApplyBatch(TestCase):
+    """Test actions that apply all their occurrences at once"""
+
+    class DefineAction(argparse.Action):
+
+        def __call__(self, parser, namespace, values, option_string=None):
+            raise AssertionError('occurrences should be batched')
+
+        def apply_batch(self, parser, namespace, occurrences):
+            defines = dict(getattr(namespace, self.dest) or {})
+            for values, option_string in occurrences:
+                if isinstance(values, str):
+                    values = [values]
+                for value in values:
+                    key, _, value = value.partition('=')
+                    defines[key] = value
+            setattr(namespace, self.dest, defines)
+            self.batches.append(occurrences)
+
+    def _get_parser(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('-D', '--define', action=self.DefineAction)
+        action.batches = []
+        parser.add_argument('-x', action='store_true')
+        return parser, action
+
+    def test_occurrences_batched(self):
+        parser, action = self._get_parser()
+        args = parser.parse_args('-D a=1 -x --define b=2 -Da=3'.split())
+        self.assertEqual(args, NS(define={'a': '3', 'b': '2'}, x=True))
+        self.assertEqual(action.batches, [[('a=1', '-D'), ('b=2', '--define'),
+                                           ('a=3', '-D')]])
+
+    def test_not_given(self):
+        parser, action = self._get_parser()
+        self.assertEqual(parser.parse_args([]), NS(define=None, x=False))
+        self.assertEqual(action.batches, [])
+
+    def test_many_occurrences(self):
+        parser, action = self._get_parser()
+        args = parser.parse_args(['-Dk%d=%d' % (i, i) for i in range(1000)])
+        self.assertEqual(len(args.define), 1000)
+        self.assertEqual(len(action.batches), 1)
+
+    def test_positional(self):
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('defines', nargs='+',
+                                     action=self.DefineAction)
+        action.batches = []
+        args = parser.parse_args('a=1 b=2'.split())
+        self.assertEqual(args, NS(defines={'a': '1', 'b': '2'}))
+        self.assertEqual(action.batches, [[(['a=1', 'b=2'], None)]])
+
+    def test_mutually_exclusive(self):
+        parser = ErrorRaisingArgumentParser()
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('-D', action=self.DefineAction).batches = []
+        group.add_argument('-x', action='store_true')
+        self.assertRaises(ArgumentParserError, parser.parse_args,
+                          '-D a=1 -x'.split())
+
+
+class TestMutuallyExclusiveDefaultValues(TestCase):
+    """Test that options given their default value count as present"""
+
+    def get_parser(self):
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--foo', type=int, default=1)
+        group.add_argument('--bar', default='x')
+        return parser
+
+    def test_interned_default(self):
+        parser = self.get_parser()
+        self.assertRaises(ArgumentParserError, parser.parse_args,
+                          '--foo 1 --bar y'.split())
+
+    def test_string_default(self):
+        parser = self.get_parser()
+        self.assertRaises(ArgumentParserError, parser.parse_args,
+                          '--foo 2 --bar x'.split())
+
+    def test_one_given(self):
+        parser = self.get_parser()
+        self.assertEqual(parser.parse_args(['--foo', '1']), NS(foo=1, bar='x'))
+        self.assertEqual(parser.parse_args([]), NS(foo=1, bar='x'))
+
+    def test_empty_positional(self):
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--foo')
+        group.add_argument('bar', nargs='*', default=[])
+        self.assertEqual(parser.parse_args(['--foo', 'x']),
+                         NS(foo='x', bar=[]))
+        self.assertRaises(ArgumentParserError, parser.parse_args,
+                          '--foo x y'.split())
+
+
+class TestProvenance(TestCase):
+    """Test recording where the parsed values came from"""
+
+    def get_parser(self):
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        parser.add_argument('--foo', type=int, default=1)
+        parser.add_argument('--flag', action='store_true')
+        parser.add_argument('spam', nargs='?', default='s')
+        parser.set_defaults(func='f')
+        return parser
+
+    def test_sources(self):
+        provenance = argparse.Provenance()
+        args = self.get_parser().parse_args(['--foo', '1', 'x'],
+                                            provenance=provenance)
+        self.assertEqual(args, NS(foo=1, flag=False, spam='x', func='f'))
+        self.assertEqual(provenance['foo'], argparse.FROM_COMMAND_LINE)
+        self.assertEqual(provenance['spam'], argparse.FROM_COMMAND_LINE)
+        self.assertEqual(provenance['flag'], argparse.FROM_DEFAULT)
+        self.assertEqual(provenance['func'], argparse.FROM_DEFAULT)
+        self.assertNotIn('help', provenance)
+        self.assertEqual(sorted(provenance.from_command_line()),
+                         ['foo', 'spam'])
+
+    def test_no_args(self):
+        provenance = argparse.Provenance()
+        self.get_parser().parse_args([], provenance=provenance)
+        self.assertEqual(sorted(provenance), ['flag', 'foo', 'func', 'spam'])
+        self.assertEqual(provenance.from_command_line(), [])
+        self.assertEqual(repr(provenance),
+                         'Provenance(flag=0, foo=0, func=0, spam=0)')
+
+    def test_namespace(self):
+        provenance = argparse.Provenance()
+        args = self.get_parser().parse_args(
+            ['--flag'], namespace=NS(foo=5, other=None),
+            provenance=provenance)
+        self.assertEqual(args, NS(foo=5, flag=True, spam='s', func='f',
+                                  other=None))
+        self.assertEqual(provenance['foo'], argparse.FROM_NAMESPACE)
+        self.assertEqual(provenance['other'], argparse.FROM_NAMESPACE)
+        self.assertEqual(provenance['flag'], argparse.FROM_COMMAND_LINE)
+        self.assertEqual(provenance.get('spam'), argparse.FROM_DEFAULT)
+
+    def test_reused(self):
+        parser = self.get_parser()
+        provenance = argparse.Provenance()
+        parser.parse_args(['--flag'], namespace=NS(other=None),
+                          provenance=provenance)
+        parser.parse_args([], provenance=provenance)
+        self.assertEqual(provenance.get('flag'), argparse.FROM_DEFAULT)
+        self.assertIsNone(provenance.get('other'))
+
+    def test_subparsers(self):
+        parser = self.get_parser()
+        subparsers = parser.add_subparsers(dest='command')
+        subparser = subparsers.add_parser('run')
+        subparser.add_argument('--jobs', type=int, default=1)
+        subparser.add_argument('--verbose', action='store_true')
+        provenance = argparse.Provenance()
+        args = parser.parse_args('x run --jobs 2'.split(),
+                                 provenance=provenance)
+        self.assertEqual(args.jobs, 2)
+        self.assertEqual(sorted(provenance.from_command_line()),
+                         ['command', 'jobs', 'spam'])
+        self.assertEqual(provenance['verbose'], argparse.FROM_DEFAULT)
+
+    def test_without_provenance(self):
+        parser = self.get_parser()
+        provenance = argparse.Provenance()
+        parser.parse_args(['--flag'], provenance=provenance)
+        parser.parse_args(['x'])
+        self.assertEqual(provenance.from_command_line(), ['flag'])
+
+    def test_async(self):
+        provenance = argparse.Provenance()
+        args = asyncio.run(self.get_parser().parse_args_async(
+            ['--foo', '3'], provenance=provenance))
+        self.assertEqual(args.foo, 3)
+        self.assertEqual(provenance.from_command_line(), ['foo'])
+
+
+class TestPackNamespace(TestCase):
+    """Test the compact form of namespaces sent to other processes"""
+
+    def get_parser(self):
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        parser.add_argument('--foo', type=int, default=1)
+        parser.add_argument('--bar', default=argparse.SUPPRESS)
+        parser.add_argument('--ids', type=int, nargs='*', default=[])
+        parser.set_defaults(func='f')
+        subparsers = parser.add_subparsers(dest='command')
+        subparser = subparsers.add_parser('run', aliases=['r'])
+        subparser.add_argument('--jobs', type=int, default=4)
+        return parser
+
+    def test_round_trip(self):
+        parser = self.get_parser()
+        args = parser.parse_args('--ids 1 2 --foo 2 run --jobs 8'.split())
+        packed = pickle.loads(pickle.dumps(parser.pack_namespace(args)))
+        self.assertEqual(self.get_parser().unpack_namespace(packed), args)
+
+    def test_unset_and_extra_attributes(self):
+        parser = self.get_parser()
+        args = parser.parse_args([], namespace=NS(other=None))
+        self.assertFalse(hasattr(args, 'bar'))
+        packed = parser.pack_namespace(args)
+        self.assertEqual(packed[2], {'other': None})
+        unpacked = parser.unpack_namespace(pickle.loads(pickle.dumps(packed)))
+        self.assertEqual(unpacked, args)
+        self.assertFalse(hasattr(unpacked, 'bar'))
+
+    def test_smaller_than_namespace(self):
+        parser = self.get_parser()
+        args = parser.parse_args(['run'])
+        self.assertLess(len(pickle.dumps(parser.pack_namespace(args))),
+                        len(pickle.dumps(args)))
+
+    def test_into_namespace(self):
+        parser = self.get_parser()
+        packed = parser.pack_namespace(parser.parse_args(['--foo', '3']))
+        namespace = NS(other=None)
+        self.assertIs(parser.unpack_namespace(packed, namespace), namespace)
+        self.assertEqual(namespace.foo, 3)
+        self.assertIsNone(namespace.other)
+
+    def test_slots_namespace(self):
+        parser = ErrorRaisingArgumentParser(namespace_class='slots')
+        parser.add_argument('--foo', default='x')
+        packed = parser.pack_namespace(parser.parse_args([]))
+        args = parser.unpack_namespace(packed)
+        self.assertEqual(args, NS(foo='x'))
+        self.assertEqual(type(args), type(parser.parse_args([])))
+
+    def test_mismatch(self):
+        parser = self.get_parser()
+        packed = parser.pack_namespace(parser.parse_args([]))
+        parser.add_argument('--baz')
+        self.assertRaises(ValueError, parser.unpack_namespace, packed)
+
+    def test_share_without_arrays(self):
+        parser = self.get_parser()
+        args = parser.parse_args('--ids 1 2'.split())
+        packed, block = parser.share_namespace(args)
+        self.assertIsNone(block)
+        self.assertEqual(packed, parser.pack_namespace(args))
+
+    def test_share_arrays(self):
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            raise unittest.SkipTest('shared memory is not available')
+        parser = self.get_parser()
+        parser.add_argument('--weights', type=float, nargs='*')
+        parser.add_argument('--big', type=int, nargs='*')
+        ids = list(range(1000))
+        weights = [i / 2 for i in range(300)]
+        big = [2 ** 70 + i for i in range(300)]
+        args = NS(ids=ids, weights=weights, big=big, foo=1)
+        packed, block = parser.share_namespace(args)
+        try:
+            self.assertIsNotNone(block)
+            self.assertLess(len(pickle.dumps(packed)),
+                            len(pickle.dumps(big)) + 1000)
+            unpacked = parser.unpack_namespace(pickle.loads(pickle.dumps(packed)))
+            self.assertIsInstance(unpacked.ids, memoryview)
+            self.assertTrue(unpacked.ids.readonly)
+            self.assertEqual(unpacked.ids.tolist(), ids)
+            self.assertEqual(unpacked.weights.tolist(), weights)
+            self.assertEqual(type(unpacked.big), list)
+            self.assertEqual(unpacked.big, big)
+            self.assertEqual(unpacked.foo, 1)
+        finally:
+            block.close()
+            block.unlink()
+
+    def test_shared_block_closed(self):
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            raise unittest.SkipTest('shared memory is not available')
+        parser = self.get_parser()
+        parser.add_argument('--weights', type=float, nargs='*')
+        ids = list(range(1000))
+        weights = [i / 2 for i in range(300)]
+        packed, block = parser.share_namespace(NS(ids=ids, weights=weights))
+        try:
+            unpacked = parser.unpack_namespace(packed)
+            attached = argparse._attached_blocks[block.name][0]
+            again = parser.unpack_namespace(packed)
+            self.assertIs(argparse._attached_blocks[block.name][0], attached)
+
+            # views made from the arrays keep the block open
+            view = unpacked.ids[10:20]
+            del unpacked, again.ids
+            self.assertIsNotNone(attached.buf)
+            self.assertEqual(view.tolist(), ids[10:20])
+            del view
+            self.assertIsNotNone(attached.buf)
+            self.assertEqual(again.weights.tolist(), weights)
+            del again
+            self.assertIsNone(attached.buf)
+            self.assertNotIn(block.name, argparse._attached_blocks)
+
+            # a block is attached again when it is unpacked again
+            unpacked = parser.unpack_namespace(packed)
+            self.assertEqual(unpacked.ids.tolist(), ids)
+            self.assertIsNot(argparse._attached_blocks[block.name][0],
+                             attached)
+            del unpacked
+            self.assertNotIn(block.name, argparse._attached_blocks)
+        finally:
+            block.close()
+            block.unlink()
+
+
+class TestFlagGroup(TestCase):
+    """Test storing the members of flag groups as bits"""
+
+    def get_parser(self, **kwargs):
+        parser = ErrorRaisingArgumentParser(prog='PROG', **kwargs)
+        parser.add_argument('--name', default='x')
+        flags = parser.add_flag_group()
+        flags.add_argument('--foo', action='store_true')
+        flags.add_argument('--bar', action='store_false')
+        flags.add_argument('--no-foo', dest='foo', action='store_false')
+        return parser
+
+    def test_parse(self):
+        parser = self.get_parser()
+        self.assertEqual(parser.parse_args([]),
+                         NS(name='x', foo=False, bar=True))
+        self.assertEqual(parser.parse_args('--foo --bar'.split()),
+                         NS(name='x', foo=True, bar=False))
+        self.assertEqual(parser.parse_args('--foo --no-foo'.split()),
+                         NS(name='x', foo=False, bar=True))
+
+    def test_storage(self):
+        parser = self.get_parser()
+        args = parser.parse_args(['--foo'])
+        self.assertIsInstance(args, argparse.Namespace)
+        self.assertEqual(args._flag_bits, 3)
+        self.assertEqual(repr(args), "Namespace(bar=True, foo=True, name='x')")
+        self.assertIn('foo', args)
+        args.bar = False
+        self.assertEqual(args._flag_bits, 1)
+        args.bar = 1
+        self.assertIs(args.bar, True)
+        args.foo = 0
+        self.assertIs(args.foo, False)
+        self.assertEqual(args._flag_bits, 2)
+
+    def test_vars_writes_through(self):
+        for kwargs in [{}, {'namespace_class': 'slots'}]:
+            parser = self.get_parser(**kwargs)
+            args = parser.parse_args(['--foo'])
+            values = vars(args)
+            self.assertEqual(values, {'name': 'x', 'foo': True, 'bar': True})
+            values['foo'] = False
+            values['name'] = 'y'
+            values.update(extra=1)
+            self.assertEqual(args, NS(name='y', foo=False, bar=True, extra=1))
+            del values['extra']
+            self.assertNotIn('extra', args)
+            self.assertRaises(KeyError, values.__getitem__, 'extra')
+            self.assertRaises(KeyError, values.__delitem__, 'extra')
+            self.assertEqual(sorted(values), ['bar', 'foo', 'name'])
+            self.assertEqual(values.copy(),
+                             {'name': 'y', 'foo': False, 'bar': True})
+
+    def test_delete(self):
+        for kwargs in [{}, {'namespace_class': 'slots'}]:
+            parser = self.get_parser(**kwargs)
+            args = parser.parse_args(['--foo'])
+            del args.foo
+            self.assertNotIn('foo', args)
+            self.assertFalse(hasattr(args, 'foo'))
+            self.assertIs(args.bar, True)
+            self.assertEqual(args, NS(name='x', bar=True))
+            self.assertEqual(repr(args), "Namespace(bar=True, name='x')")
+            self.assertRaises(AttributeError, delattr, args, 'foo')
+
+            values = vars(args)
+            self.assertIn('bar', values)
+            del values['bar']
+            self.assertNotIn('bar', values)
+            self.assertNotIn('bar', args)
+            self.assertRaises(KeyError, values.__delitem__, 'bar')
+            self.assertEqual(values, {'name': 'x'})
+
+            args.bar = 0
+            self.assertEqual(args, NS(name='x', bar=False))
+            self.assertEqual(copy.copy(args), NS(name='x', bar=False))
+
+            # deleted flags take their defaults again when parsed into
+            args = parser.parse_args(['--bar'], namespace=args)
+            self.assertEqual(args, NS(name='x', foo=False, bar=False))
+
+    def test_many_flags(self):
+        parser = ErrorRaisingArgumentParser()
+        flags = parser.add_flag_group()
+        for i in range(3000):
+            flags.add_argument('--f%d' % i, action='store_true')
+        args = parser.parse_args(['--f2999', '--f5'])
+        self.assertEqual(args._flag_bits, 1 << 2999 | 1 << 5)
+        self.assertTrue(args.f2999)
+        self.assertFalse(args.f2998)
+        self.assertEqual(sum(vars(args).values()), 2)
+
+    def test_slots(self):
+        parser = self.get_parser(namespace_class='slots')
+        args = parser.parse_args(['--foo'])
+        self.assertEqual(args, NS(name='x', foo=True, bar=True))
+        self.assertIn('name', type(args).__slots__)
+        self.assertNotIn('foo', type(args).__slots__)
+
+    def test_copy_and_pickle(self):
+        parser = self.get_parser()
+        args = parser.parse_args(['--bar'])
+        for copied in [copy.copy(args), copy.deepcopy(args)]:
+            self.assertIs(type(copied), type(args))
+            self.assertEqual(copied, args)
+        unpickled = pickle.loads(pickle.dumps(args))
+        self.assertIs(type(unpickled), argparse.Namespace)
+        self.assertEqual(unpickled, args)
+
+    def test_given_namespace(self):
+        parser = self.get_parser()
+        args = parser.parse_args(['--foo'], namespace=NS(bar=False))
+        self.assertEqual(args, NS(name='x', foo=True, bar=False))
+
+    def test_other_action_for_dest(self):
+        parser = self.get_parser()
+        parser.add_argument('--set-bar', dest='bar', type=int)
+        args = parser.parse_args('--set-bar 5 --foo'.split())
+        self.assertEqual(args, NS(name='x', foo=True, bar=5))
+        self.assertEqual(args._flag_bits, 1)
+
+    def test_set_defaults(self):
+        parser = self.get_parser()
+        parser.set_defaults(foo=True)
+        self.assertEqual(parser.parse_args([]),
+                         NS(name='x', foo=True, bar=True))
+        parser.set_defaults(foo=None)
+        self.assertEqual(parser.parse_args([]),
+                         NS(name='x', foo=None, bar=True))
+
+    def test_subparsers(self):
+        parser = self.get_parser()
+        subparsers = parser.add_subparsers()
+        subparser = subparsers.add_parser('run')
+        subparser.add_flag_group().add_argument('--fast', action='store_true')
+        args = parser.parse_args('--foo run --fast'.split())
+        self.assertEqual(args, NS(name='x', foo=True, bar=True, fast=True))
+
+    def test_parents(self):
+        parser = ErrorRaisingArgumentParser(parents=[self.get_parser()],
+                                            add_help=False)
+        args = parser.parse_args(['--foo'])
+        self.assertEqual(args, NS(name='x', foo=True, bar=True))
+        self.assertTrue(hasattr(args, '_flag_bits'))
+
+    def test_argument_group(self):
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        group = parser.add_argument_group('toggles')
+        flags = group.add_flag_group()
+        flags.add_argument('--foo', action='store_true', help='FOO')
+        self.assertIn('toggles:\n  --foo       FOO', parser.format_help())
+        self.assertEqual(parser.parse_args(['--foo']), NS(foo=True))
+
+    def test_invalid_action(self):
+        flags = ErrorRaisingArgumentParser().add_flag_group()
+        self.assertRaises(ValueError, flags.add_argument, '--foo')
+        self.assertRaises(ValueError, flags.add_argument, '--foo',
+                          action='store_const', const=True)
+
+
+class TestInternTable(TestCase):
+    """Test sharing string values between parses"""
+
+    def fresh(self, string):
+        return (string + '.')[:-1]
+
+    def get_parser(self, table):
+        parser = ErrorRaisingArgumentParser(intern_table=table)
+        parser.add_argument('--region')
+        parser.add_argument('--count', type=int)
+        parser.add_argument('items', nargs='*', type=str.lower)
+        return parser
+
+    def test_values_shared(self):
+        table = argparse.InternTable()
+        parser = self.get_parser(table)
+        args1, extras1 = parser.parse_known_args(
+            ['--region', self.fresh('eu'), 'A', self.fresh('--x')])
+        args2, extras2 = parser.parse_known_args(
+            ['--region', self.fresh('eu'), 'a', self.fresh('--x')])
+        self.assertEqual(args1, args2)
+        self.assertIs(args1.region, args2.region)
+        self.assertIs(args1.items[0], args2.items[0])
+        self.assertIs(extras1[0], extras2[0])
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.hits, 3)
+        self.assertEqual(table.misses, 3)
+        self.assertEqual(table.bytes_saved,
+                         sys.getsizeof('eu') + sys.getsizeof('a') +
+                         sys.getsizeof('--x'))
+
+    def test_non_strings(self):
+        table = argparse.InternTable()
+        args = self.get_parser(table).parse_args(['--count', '3'])
+        self.assertEqual(args.count, 3)
+        self.assertEqual(len(table), 0)
+
+    def test_maxsize(self):
+        table = argparse.InternTable(maxsize=2)
+        parser = self.get_parser(table)
+        args = parser.parse_args('a b c'.split())
+        self.assertEqual(args.items, ['a', 'b', 'c'])
+        self.assertEqual(len(table), 2)
+        args = parser.parse_args([self.fresh('c')])
+        self.assertEqual(table.hits, 0)
+        self.assertEqual(table.misses, 4)
+
+    def test_clear(self):
+        table = argparse.InternTable()
+        parser = self.get_parser(table)
+        parser.parse_args(['a'])
+        parser.parse_args(['a'])
+        table.clear()
+        self.assertEqual(len(table), 0)
+        self.assertEqual(repr(table), 'InternTable(size=0, maxsize=65536, '
+                         'hits=0, misses=0, bytes_saved=0)')
+
+    def test_subparsers(self):
+        table = argparse.InternTable()
+        parser = self.get_parser(table)
+        subparsers = parser.add_subparsers()
+        subparser = subparsers.add_parser('run')
+        subparser.add_argument('--name')
+        args1 = parser.parse_args(['run', '--name', self.fresh('n')])
+        args2 = parser.parse_args(['run', '--name', self.fresh('n')])
+        self.assertIs(args1.name, args2.name)
+
+    def test_without_table(self):
+        parser = self.get_parser(None)
+        args1 = parser.parse_args(['--region', self.fresh('eu')])
+        args2 = parser.parse_args(['--region', self.fresh('eu')])
+        self.assertIsNot(args1.region, args2.region)
+
+    def test_conversion_executor(self):
+        table = argparse.InternTable()
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            parser = ErrorRaisingArgumentParser(intern_table=table,
+                                                conversion_executor=executor)
+            parser.add_argument('items', nargs='*', type=str.lower)
+            args1 = parser.parse_args(['A', self.fresh('b')])
+            args2 = parser.parse_args(['a', self.fresh('B')])
+        self.assertEqual(args1, NS(items=['a', 'b']))
+        self.assertIs(args1.items[0], args2.items[0])
+        self.assertIs(args1.items[1], args2.items[1])
+        self.assertEqual(len(table), 2)
+
+    def test_parse_args_async(self):
+        async def lower(string):
+            return string.lower()
+
+        table = argparse.InternTable()
+        parser = ErrorRaisingArgumentParser(intern_table=table)
+        parser.add_argument('items', nargs='*', type=lower)
+        args1 = asyncio.run(parser.parse_args_async(['A', 'b']))
+        args2 = asyncio.run(parser.parse_args_async(['a', 'B']))
+        self.assertEqual(args1, NS(items=['a', 'b']))
+        self.assertIs(args1.items[0], args2.items[0])
+        self.assertIs(args1.items[1], args2.items[1])
+        self.assertEqual(len(table), 2)
+
+
 # ===================
 # File encoding tests
 # ===================
@@ -4714,6 +6697,264 @@ class TestParseKnownArgs(TestCase):
         self.assertEqual(NS(v=3, spam=True, badger="B"), args)
         self.assertEqual(["C", "--foo", "4"], extras)
 
+# ==========================
+# exit_on_error=False tests
+# ==========================
+
+class TestExitOnErrorFalse(TestCase):
+
+    def setUp(self):
+        super(TestExitOnErrorFalse, self).setUp()
+        self.parser = argparse.ArgumentParser(exit_on_error=False)
+        self.parser.add_argument('--integer', type=int)
+        self.parser.add_argument('--interval', type=int)
+        self.parser.add_argument('name')
+        group = self.parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('-x', action='store_true')
+        group.add_argument('-y', action='store_true')
+
+    def assertParseError(self, args, message):
+        with mock.patch('sys.stderr', StringIO()) as stderr:
+            with self.assertRaises(argparse.ArgumentError) as cm:
+                self.parser.parse_args(args.split())
+        self.assertEqual(str(cm.exception), message)
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_success(self):
+        self.assertEqual(self.parser.parse_args('-x --integer 1 a'.split()),
+                         NS(integer=1, interval=None, name='a', x=True,
+                            y=False))
+
+    def test_errors_are_raised(self):
+        self.assertParseError('-x --integer z a',
+                              "argument --integer: invalid int value: 'z'")
+        self.assertParseError('-x', 'the following arguments are required: '
+                              'name')
+        self.assertParseError('a', 'one of the arguments -x -y is required')
+        self.assertParseError('-x a b', 'unrecognized arguments: b')
+        self.assertParseError('-x --int 1 a', 'ambiguous option: --int could '
+                              'match --integer, --interval')
+        self.assertParseError('-x -y a', 'argument -y: not allowed with '
+                              'argument -x')
+
+    def test_file_errors_are_raised(self):
+        self.parser.fromfile_prefix_chars = '@'
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'missing')
+            with mock.patch('sys.stderr', StringIO()) as stderr:
+                with self.assertRaises(argparse.ArgumentError) as cm:
+                    self.parser.parse_args(['-x', 'a', '@' + path])
+        self.assertIsNone(cm.exception.argument_name)
+        self.assertIn(path, str(cm.exception))
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_subparser_errors_are_raised(self):
+        subparsers = self.parser.add_subparsers()
+        subparser = subparsers.add_parser('run')
+        subparser.add_argument('--n', type=int)
+        subsubparsers = subparser.add_subparsers()
+        subsubparsers.add_parser('all').add_argument('m', type=int)
+        self.assertParseError('-x a run --n z',
+                              "argument --n: invalid int value: 'z'")
+        self.assertParseError('-x a run all z',
+                              "argument m: invalid int value: 'z'")
+
+    def test_subparser_errors_exit(self):
+        parser = ErrorRaisingArgumentParser(prog='PROG')
+        subparsers = parser.add_subparsers()
+        subparser = subparsers.add_parser('run')
+        subparser.add_argument('--n', type=int)
+        with self.assertRaises(ArgumentParserError) as cm:
+            parser.parse_args('run --n z'.split())
+        self.assertTrue(cm.exception.stderr.startswith('usage: PROG run'))
+
+
+# ============================
+# parse_args_async tests
+# ============================
+
+class TestParseArgsAsync(TestCase):
+
+    def setUp(self):
+        super(TestParseArgsAsync, self).setUp()
+        self.running = 0
+        self.peak = 0
+
+    async def lookup(self, string):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            await asyncio.sleep(0.01)
+            if string.startswith('bad'):
+                raise ValueError(string)
+            if string.startswith('worse'):
+                raise argparse.ArgumentTypeError('no such key %r' % string)
+            return string.upper()
+        finally:
+            self.running -= 1
+
+    def parse(self, parser, args, **kwargs):
+        return asyncio.run(parser.parse_args_async(args, **kwargs))
+
+    def test_conversions_run_concurrently(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('-k', action='append', type=self.lookup)
+        parser.add_argument('keys', nargs='+', type=self.lookup)
+        parser.add_argument('--size', type=int)
+        args = self.parse(parser, '-k a x y z --size 3 -k b'.split())
+        self.assertEqual(args, NS(k=['A', 'B'], keys=['X', 'Y', 'Z'], size=3))
+        self.assertEqual(self.peak, 5)
+
+    def test_max_concurrency(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('keys', nargs='+', type=self.lookup)
+        args = self.parse(parser, 'a b c d e'.split(), max_concurrency=2)
+        self.assertEqual(args, NS(keys=['A', 'B', 'C', 'D', 'E']))
+        self.assertEqual(self.peak, 2)
+
+    def test_nested_values_and_defaults(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('-k', action='append', nargs=2, type=self.lookup)
+        parser.add_argument('--key', type=self.lookup, default='d')
+        args = self.parse(parser, '-k a b -k c d'.split())
+        self.assertEqual(args, NS(k=[['A', 'B'], ['C', 'D']], key='D'))
+
+    def test_choices_checked_after_conversion(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('key', type=self.lookup, choices=['A', 'B'])
+        self.assertEqual(self.parse(parser, ['b']), NS(key='B'))
+        with self.assertRaises(ArgumentParserError) as cm:
+            self.parse(parser, ['c'])
+        self.assertIn("argument key: invalid choice: 'C'", cm.exception.stderr)
+
+    def test_first_error_reported(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('-k', type=self.lookup)
+        parser.add_argument('keys', nargs='+', type=self.lookup)
+        with self.assertRaises(ArgumentParserError) as cm:
+            self.parse(parser, 'a worse1 bad2 -k bad3'.split())
+        self.assertIn("argument keys: no such key 'worse1'",
+                      cm.exception.stderr)
+        with self.assertRaises(ArgumentParserError) as cm:
+            self.parse(parser, '-k bad1 a worse2'.split())
+        self.assertIn("argument -k: invalid lookup value: 'bad1'",
+                      cm.exception.stderr)
+
+    def test_subparsers(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--key', type=self.lookup)
+        subparsers = parser.add_subparsers()
+        subparser = subparsers.add_parser('run')
+        subparser.add_argument('keys', nargs='*', type=self.lookup)
+        args = self.parse(parser, '--key a run b c'.split())
+        self.assertEqual(args, NS(key='A', keys=['B', 'C']))
+
+    def test_awaitable_requires_storing_action(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('--key', type=self.lookup, action=SetAttrAction)
+        with self.assertRaises(ArgumentParserError) as cm:
+            self.parse(parser, '--key a'.split())
+        self.assertIn('argument --key: awaitable values require a store or '
+                      'append action', cm.exception.stderr)
+
+    def test_cache_rejected_for_coroutine_functions(self):
+        parser = ErrorRaisingArgumentParser()
+        self.assertRaises(ValueError, parser.add_argument, '-k',
+                          type=self.lookup, cache=True)
+
+    def test_cache_with_awaitables(self):
+        lookup = self.lookup
+
+        class Lookup(object):
+            def __call__(self, string):
+                return lookup(string)
+
+        parser = ErrorRaisingArgumentParser()
+        action = parser.add_argument('-k', action='append', type=Lookup(),
+                                     cache=True)
+        for args in ['-k a -k a', '-k a']:
+            with self.assertRaises(ArgumentParserError) as cm:
+                self.parse(parser, args.split())
+            self.assertIn('argument -k: cached type functions cannot return '
+                          'awaitables', cm.exception.stderr)
+        self.assertEqual(action.conversion_cache.cache_info().currsize, 0)
+
+    def test_parse_args_unchanged(self):
+        parser = ErrorRaisingArgumentParser()
+        parser.add_argument('key', type=str.upper)
+        self.assertEqual(self.parse(parser, ['a']), NS(key='A'))
+        self.assertRaises(ArgumentParserError, self.parse, parser, 'a b'.split())
+
+
+class TestConversionExecutor(TestCase):
+
+    def setUp(self):
+        super(TestConversionExecutor, self).setUp()
+        self.executor = concurrent.futures.ThreadPoolExecutor(4)
+        self.addCleanup(self.executor.shutdown)
+        self.threads = set()
+
+    def path(self, string):
+        self.threads.add(threading.get_ident())
+        if string.startswith('bad'):
+            raise ValueError(string)
+        return string.upper()
+
+    def test_values_converted_concurrently(self):
+        barrier = threading.Barrier(3, timeout=10)
+        def wait(string):
+            barrier.wait()
+            return string.upper()
+        parser = ErrorRaisingArgumentParser(conversion_executor=self.executor)
+        parser.add_argument('-f', type=wait)
+        parser.add_argument('files', nargs=2, type=wait)
+        args = parser.parse_args('-f a b c'.split())
+        self.assertEqual(args, NS(f='A', files=['B', 'C']))
+
+    def test_order_preserved(self):
+        parser = ErrorRaisingArgumentParser(conversion_executor=self.executor)
+        parser.add_argument('-i', action='append', type=self.path)
+        parser.add_argument('files', nargs='*', type=self.path,
+                            choices=['A', 'B', 'C', 'D'])
+        args = parser.parse_args('a b c d -i x -i y'.split())
+        self.assertEqual(args, NS(i=['X', 'Y'], files=['A', 'B', 'C', 'D']))
+        self.assertNotIn(threading.get_ident(), self.threads)
+
+    def test_first_error_reported(self):
+        parser = ErrorRaisingArgumentParser(conversion_executor=self.executor)
+        parser.add_argument('-i', type=self.path)
+        parser.add_argument('files', nargs='*', type=self.path,
+                            choices=['A', 'B'])
+        for args, message in [
+            ('-i bad1 a bad2', "argument -i: invalid path value: 'bad1'"),
+            ('a bad1 -i bad2', "argument files: invalid path value: 'bad1'"),
+            ('a c bad1', "argument files: invalid choice: 'C'"),
+        ]:
+            with self.assertRaises(ArgumentParserError) as cm:
+                parser.parse_args(args.split())
+            self.assertIn(message, cm.exception.stderr)
+
+    def test_other_actions_converted_directly(self):
+        parser = ErrorRaisingArgumentParser(conversion_executor=self.executor)
+        parser.add_argument('--key', type=self.path, action=SetAttrAction)
+        self.assertEqual(parser.parse_args('--key a'.split()), NS(key='A'))
+        self.assertEqual(self.threads, {threading.get_ident()})
+
+    def test_subparsers(self):
+        parser = ErrorRaisingArgumentParser(conversion_executor=self.executor)
+        subparsers = parser.add_subparsers(dest='command')
+        subparser = subparsers.add_parser('run')
+        subparser.add_argument('files', nargs='+', type=self.path)
+        args = parser.parse_args('run a b'.split())
+        self.assertEqual(args, NS(command='run', files=['A', 'B']))
+        self.assertNotIn(threading.get_ident(), self.threads)
+
+
+class SetAttrAction(argparse.Action):
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        setattr(namespace, self.dest, values)
+
 # ==========================
 # add_argument metavar tests
 # ==========================